@@ -1,23 +1,72 @@
 from flask import Flask, render_template
 import os
+import time
+import secrets
 from datetime import timedelta
 
+# Explicit template/static folder paths, resolved once at import
+_HERE = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_DIR = os.path.join(_HERE, 'templates')
+STATIC_DIR = os.path.join(_HERE, 'static')
+
+# token_hex(32) is 64 characters; anything shorter is a file still being written
+_SECRET_KEY_LENGTH = 64
+
+def _write_dev_secret_key(key_path, replace=False):
+    """
+    Write a fresh key to a private temp file and move it into place atomically, so
+    other workers either see no key file or a complete one. Without `replace` the
+    first worker to link its key wins.
+    """
+    tmp_path = f"{key_path}.{os.getpid()}.{secrets.token_hex(4)}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_hex(32))
+            f.flush()
+            os.fsync(f.fileno())
+        if replace:
+            os.replace(tmp_path, key_path)
+        else:
+            try:
+                os.link(tmp_path, key_path)
+            except FileExistsError:
+                pass
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+def _load_dev_secret_key(instance_path):
+    """Read the development secret key from the instance folder, creating it on first run"""
+    key_path = os.path.join(instance_path, 'secret.key')
+    try:
+        os.makedirs(instance_path, exist_ok=True)
+        if not os.path.exists(key_path):
+            _write_dev_secret_key(key_path)
+        # An empty or short read is a key file left half-written; never use it as the key
+        for attempt in range(5):
+            with open(key_path) as f:
+                key = f.read().strip()
+            if len(key) >= _SECRET_KEY_LENGTH:
+                return key
+            time.sleep(0.1 * (attempt + 1))
+        print("[App] Secret key file is incomplete; replacing it")
+        _write_dev_secret_key(key_path, replace=True)
+        with open(key_path) as f:
+            return f.read().strip()
+    except OSError as e:
+        # Read-only filesystem (e.g. serverless): fall back to a path-derived key
+        print(f"[App] Could not persist secret key ({e}); using a path-derived key")
+        import hashlib
+        return hashlib.sha256(os.path.dirname(__file__).encode()).hexdigest()
+
 def create_app(test_config=None):
     """Create and configure the Flask application"""
-    # Explicitly set the template folder path
-    template_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), 'templates'))
-    static_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), 'static'))
-    
-    app = Flask(__name__, instance_relative_config=True, template_folder=template_dir, static_folder=static_dir)
-    
-    # Generate a stable secret key if not provided
-    # This ensures sessions persist across server restarts
-    secret_key = os.getenv('SECRET_KEY')
-    if not secret_key:
-        # Use a hash of the app path as fallback for development
-        # In production, always set SECRET_KEY in environment
-        import hashlib
-        secret_key = hashlib.sha256(os.path.dirname(__file__).encode()).hexdigest()
+    app = Flask(__name__, instance_relative_config=True, template_folder=TEMPLATE_DIR, static_folder=STATIC_DIR)
+    
+    # Use a stable secret key so sessions persist across server restarts
+    # In production, always set SECRET_KEY in environment
+    secret_key = os.getenv('SECRET_KEY') or _load_dev_secret_key(app.instance_path)
     
     # Set up configuration
     app.config.from_mapping(
@@ -29,11 +78,26 @@ def create_app(test_config=None):
         SESSION_COOKIE_SECURE=False,  # Set to True in production with HTTPS
         SESSION_COOKIE_HTTPONLY=True,
         SESSION_COOKIE_SAMESITE='Lax',
+        # Create MongoDB indexes once at startup. Off by default on serverless, where
+        # every cold start would pay for it; run `flask create-indexes` on deploy instead
+        CREATE_INDEXES=os.getenv('CREATE_INDEXES', 'false' if os.getenv('VERCEL') else 'true').lower() == 'true',
     )
     
     if test_config:
         app.config.from_mapping(test_config)
     
+    # Faster JSON for API responses and session cookies when orjson is installed
+    from app.utils.json_provider import OrjsonProvider, orjson
+    if orjson is not None:
+        app.json = OrjsonProvider(app)
+    
+    from app.utils.db_utils import ensure_indexes, get_collections
+    if app.config['CREATE_INDEXES']:
+        ensure_indexes()
+    
+    # Collection handles shared by all views (current_app.extensions['collections'])
+    app.extensions['collections'] = get_collections()
+    
     # Register blueprints
     from app.routes.auth import auth_bp
     from app.routes.main import main_bp
@@ -47,6 +111,25 @@ def create_app(test_config=None):
     app.register_blueprint(career_coach_bp)
     app.register_blueprint(tutor_bp)  # Register the new tutor blueprint
     
+    # CLI commands
+    @app.cli.command('create-indexes')
+    def create_indexes():
+        """Create the MongoDB indexes the app relies on."""
+        ensure_indexes()
+        print("Indexes ensured")
+    
+    @app.cli.command('backfill-chat-html')
+    def backfill_chat_html():
+        """Pre-render HTML for stored Leo messages that are missing it."""
+        from app.routes.career_coach import backfill_rendered_responses
+        print(f"Updated {backfill_rendered_responses()} conversations")
+    
+    @app.cli.command('migrate-roadmaps')
+    def migrate_roadmaps_command():
+        """Convert JSON-string road_map fields to native subdocuments."""
+        from app.utils.db_utils import migrate_roadmaps
+        print(f"Migrated {migrate_roadmaps()} roadmaps")
+    
     # Register error handlers
     @app.errorhandler(404)
     def page_not_found(e):
@@ -1,10 +1,13 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
+from pymongo.errors import DuplicateKeyError
 from app.utils.db_utils import (
     check_existing_user,
     insert_user,
     find_user_by_credentials,
     hash_password,
-    verify_password
+    verify_password,
+    password_needs_rehash,
+    update_user_profile
 )
 
 # Account creation
@@ -18,53 +21,60 @@ def sign_up():
     
     if request.method == 'POST':
         # Get form data
-        username = request.form['username']
-        name = request.form['name']
-        email = request.form['email']
-        phone = request.form['phone']
-        dob = request.form['dob']
-        password = request.form['password']
-        confirm_password = request.form['confirm_password']
+        form = request.form
+        username = form['username'].strip()
+        user_id = username.lower()
+        name = form['name']
+        email = form['email'].strip().lower()
+        phone = form['phone']
+        dob = form['dob']
+        password = form['password']
+        confirm_password = form['confirm_password']
         
         # Check if passwords match
         if password != confirm_password:
             error = "Passwords do not match. Please try again."
             return render_template("sign_up.html", error=error)
         
-        # Hash the password for security        
-        hashed_password = hash_password(password)
-        
         # Check if the email or username already exists
-        existing_user = check_existing_user(email, username)
+        existing_user = check_existing_user(email, user_id)
         
         if existing_user:
             error = "Email or username already exists. Please use a different one."
             return render_template("sign_up.html", error=error)
         
+        # Hash the password for security (only once the account is known to be new)
+        hashed_password = hash_password(password)
+        
         # Insert the new user into the MongoDB collection
         new_user = {
-            "user_id": username.lower(),
+            "user_id": user_id,
             "name": name,
             "phone": phone,
             "dob": dob,
-            "email": email.lower(),
+            "email": email,
             "password": hashed_password,
-            "joining_date": request.form.get("startdate", None),
-            "career_goal": request.form.get("career_goal", None),
-            "entrepreneurship_interest": request.form.get("entrepreneurship_interest", None),
-            "key_interests": request.form.get("interested_industries", "").split(", "),  # Split into list
-            "dream_company": request.form.get("dream_company", None),
-            "company_preference": request.form.get("company_preference", None),
-            "preferred_company": request.form.get("preferred_company", None),
-            "personal_statement": request.form.get("personal_statement", None),
-            "github_profile": request.form.get("githubProfile", None),
-            "linkedin_profile": request.form.get("linkedinProfile", None),
+            "joining_date": form.get("startdate"),
+            "career_goal": form.get("career_goal"),
+            "entrepreneurship_interest": form.get("entrepreneurship_interest"),
+            # Split into list; tolerate missing spaces after commas
+            "key_interests": [s.strip() for s in form.get("interested_industries", "").split(",") if s.strip()],
+            "dream_company": form.get("dream_company"),
+            "company_preference": form.get("company_preference"),
+            "preferred_company": form.get("preferred_company"),
+            "personal_statement": form.get("personal_statement"),
+            "github_profile": form.get("githubProfile"),
+            "linkedin_profile": form.get("linkedinProfile"),
         }
         
         try:
             insert_user(new_user)  # Insert new user using db_utils function
             flash("Account created successfully! Please log in.", "success")
             return redirect(url_for('auth_bp.sign_in'))
+        except DuplicateKeyError:
+            # Lost a race with a concurrent sign-up; the unique indexes reject the second insert
+            error = "Email or username already exists. Please use a different one."
+            return render_template("sign_up.html", error=error)
         except Exception as e:
             error = f"An error occurred: {e}"
             return render_template("sign_up.html", error=error)
@@ -88,6 +98,9 @@ def sign_in():
         if user:                        
             # Verify the password using function from db_utils
             if verify_password(password, user['password']):
+                # Upgrade hashes made with an outdated work factor
+                if password_needs_rehash(user['password']):
+                    update_user_profile(user['user_id'], {"password": hash_password(password)})
                 # Store user info in the session
                 session['user_id'] = user['user_id']  # Save user ID in session
                 session['name'] = user['name']
@@ -1,16 +1,112 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session
-from datetime import datetime
-from markdown2 import Markdown
-from app.utils.llm_utils import get_mistral_response, fetch_github_projects
-from app.utils.db_utils import get_db, get_user_by_id
-from app.utils.linkedin import fetch_linkedin_profile_brightdata
+from flask import Blueprint, Response, current_app, render_template, request, redirect, url_for, session, jsonify, stream_with_context
+from datetime import datetime, timedelta
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import re
+from html import escape
+from bson import ObjectId
+from cachetools import TTLCache
+from app.utils.db_utils import get_db, get_user_by_id, get_linkedin_profile, invalidate_user_cache
 
-# Initialize markdown converter
-markdowner = Markdown()
+# LLM SDKs and the LinkedIn scraper are imported inside the views so that
+# app start-up (workers, CLI commands) doesn't pay for them.
+
+@lru_cache(maxsize=1)
+def get_markdowner():
+    """Shared markdown converter, created on first use"""
+    from markdown2 import Markdown
+    return Markdown()
+
+# Characters/patterns that mean a reply needs the full markdown pass
+# ("+" starts a bullet, "=" underlines a setext heading)
+_MD_CHARS = frozenset("*_`[#>-|+=")
+_MD_ORDERED_LIST = re.compile(r"^\s*\d+[.)]\s", re.MULTILINE)
+
+def to_html(text):
+    """
+    Render an LLM reply as HTML, skipping markdown2 for plain-text replies.
+    """
+    if _MD_CHARS.isdisjoint(text) and not _MD_ORDERED_LIST.search(text):
+        paragraphs = (p.strip() for p in text.split("\n\n"))
+        return "\n\n".join(
+            f"<p>{escape(p).replace(chr(10), '<br>')}</p>" for p in paragraphs if p
+        ) + "\n"
+    return get_markdowner().convert(text)
 
 # Career coach blueprint
 career_coach_bp = Blueprint('career_coach_bp', __name__)
 
+# Only the most recent messages are rendered; stored history is capped too
+HISTORY_RENDER_LIMIT = 50
+HISTORY_STORE_LIMIT = 200
+HISTORY_PROJECTION = {"messages": {"$slice": -HISTORY_RENDER_LIMIT}, "_id": 0}
+
+# LinkedIn scrapes run in the background so chat replies never wait on them
+LINKEDIN_REFRESH_HOURS = 24
+_scrape_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="linkedin")
+_scrapes_in_flight = set()
+# Users whose refresh was queued recently; keeps a failing scrape from being
+# retried on every chat message
+_recent_scrapes = TTLCache(maxsize=2048, ttl=300)
+_scrapes_lock = threading.Lock()
+
+def schedule_linkedin_refresh(linkedin_url, user_id, profile=None):
+    """
+    Queue a background LinkedIn scrape unless the stored profile is still
+    fresh or a scrape for this user is already running.
+
+    Args:
+        linkedin_url: The user's LinkedIn profile URL
+        user_id: The user's ID
+        profile: The currently stored LinkedIn document, if any
+    """
+    last_updated = (profile or {}).get("last_updated")
+    if isinstance(last_updated, datetime) and \
+            datetime.utcnow() - last_updated < timedelta(hours=LINKEDIN_REFRESH_HOURS):
+        return
+
+    with _scrapes_lock:
+        if user_id in _scrapes_in_flight or user_id in _recent_scrapes:
+            return
+        _scrapes_in_flight.add(user_id)
+        _recent_scrapes[user_id] = True
+
+    def run():
+        from app.utils.linkedin import fetch_linkedin_profile_brightdata
+        try:
+            fetch_linkedin_profile_brightdata(linkedin_url, user_id)
+        except Exception as e:
+            print(f"[Leo] LinkedIn fetch warning: {e}")
+        finally:
+            with _scrapes_lock:
+                _scrapes_in_flight.discard(user_id)
+
+    _scrape_pool.submit(run)
+
+# Shared pool for the independent per-request reads (MongoDB, GitHub)
+_io_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="leo-io")
+# Seconds to wait for GitHub before answering without it
+GITHUB_FETCH_TIMEOUT = 10
+
+# Static parts of Leo's prompt, built once
+PROMPT_HEADER = "You are Leo, a professional and encouraging Career Coach AI."
+PROMPT_INSTRUCTIONS = """=== INSTRUCTIONS ===
+1. Address the user as "{first_name}".
+2. Answer the user's question based on their FULL profile above, including their career aspirations.
+3. If they ask about jobs, suggest roles that align with their Career Goal ({career_goal}) and Dream Company ({dream_company}).
+4. Reference their GitHub projects when discussing their portfolio or technical skills.
+5. Remember the conversation history to provide contextual, coherent responses.
+6. Be concise (max 3 short paragraphs).
+7. Use a warm, professional, and motivating tone.
+8. Use formatting (bullet points, bold text) where helpful."""
+
+def _join_limited(values, limit, default):
+    """Comma-join the first `limit` items of a list (or pass a plain string through)"""
+    if isinstance(values, list):
+        return ', '.join(map(str, values[:limit])) or default
+    return str(values) if values else default
+
 def generate_prompt(user_data, user_query, chat_history, github_projects=None, user_profile=None):
     """
     Generates a context-aware prompt for the LLM using LinkedIn data, GitHub projects, and career goals.
@@ -35,8 +131,9 @@ def generate_prompt(user_data, user_query, chat_history, github_projects=None, u
     dream_company = profile.get("dream_company", "Not specified")
     company_preference = profile.get("company_preference", "Not specified")
     personal_statement = profile.get("personal_statement", "Not provided")
-    industries = profile.get("interested_industries") or profile.get("key_interests", [])
-    industries_str = ', '.join(industries[:5]) if isinstance(industries, list) else str(industries) if industries else "Not specified"
+    industries_str = _join_limited(
+        profile.get("interested_industries") or profile.get("key_interests", []), 5, "Not specified"
+    )
 
     # === 2. Skills / Interests ===
     # In our DB schema, 'interests' holds the skills/languages from LinkedIn
@@ -45,217 +142,268 @@ def generate_prompt(user_data, user_query, chat_history, github_projects=None, u
         # Fallback to manual key_interests if LinkedIn skills are empty
         skills = user_data.get("key_interests", [])
     
-    skills_str = ', '.join(skills[:15]) if skills else 'None listed'
+    skills_str = _join_limited(skills, 15, "None listed")
 
     # === 3. Experience ===
     # Format the first 3 experiences
     experiences = user_data.get("experiences", [])
-    experience_list = []
-    for exp in experiences[:3]:
-        title = exp.get('title', 'Role')
-        company = exp.get('company', 'Company')
-        duration = exp.get('duration', '')
-        # Add to list string
-        experience_list.append(f"- {title} at {company} ({duration})")
-    
-    exp_str = "\n".join(experience_list) if experience_list else "No experience listed."
+    exp_str = "\n".join(
+        f"- {exp.get('title', 'Role')} at {exp.get('company', 'Company')} ({exp.get('duration', '')})"
+        for exp in experiences[:3]
+    ) or "No experience listed."
 
     # === 4. Education ===
     # Format the first 2 education entries
     educations = user_data.get("education", [])
-    education_list = []
-    for edu in educations[:2]:
-        school = edu.get('institution', 'University')
-        degree = edu.get('degree', 'Degree')
-        major = edu.get('description', '')
-        education_list.append(f"- {degree} in {major} from {school}")
-    
-    edu_str = "\n".join(education_list) if education_list else "No education listed."
+    edu_str = "\n".join(
+        f"- {edu.get('degree', 'Degree')} in {edu.get('description', '')} from {edu.get('institution', 'University')}"
+        for edu in educations[:2]
+    ) or "No education listed."
 
     # GitHub Projects
     github_str = "No GitHub projects available."
-    if github_projects and isinstance(github_projects, list) and len(github_projects) > 0:
-        project_lines = []
-        for repo in github_projects:
-            name = repo.get('title', 'Project')
-            desc = repo.get('description', 'No description')
-            lang = repo.get('language', 'Unknown')
-            stars = repo.get('stars', 0)
-            project_lines.append(f"- {name} ({lang}, {stars}★): {desc[:80]}")
-        github_str = "\n".join(project_lines)
+    if github_projects and isinstance(github_projects, list):
+        github_str = "\n".join(
+            f"- {repo.get('title', 'Project')} ({repo.get('language', 'Unknown')}, {repo.get('stars', 0)}★): "
+            f"{repo.get('description', 'No description')[:80]}"
+            for repo in github_projects
+        )
 
     # === 6. Chat History (Last 3 interactions for context) ===
-    recent_history = chat_history[-3:]
-    history_str = ""
-    for msg in recent_history:
-        if isinstance(msg, dict):
-            history_str += f"User: {msg.get('prompt', '')}\nLeo: {msg.get('raw_response', '')}\n"
-
-    if not history_str:
-        history_str = "No previous conversation."
+    history_str = "".join(
+        f"User: {msg.get('prompt', '')}\nLeo: {msg.get('raw_response', '')}\n"
+        for msg in chat_history[-3:] if isinstance(msg, dict)
+    ) or "No previous conversation."
 
     # === FINAL PROMPT CONSTRUCTION ===
-    return f"""
-        You are Leo, a professional and encouraging Career Coach AI.
-        
-        === USER PROFILE ===
-        Name: {full_name}
-        Headline: {headline}
-        Summary: {about_summary}
-        
-        === CAREER ASPIRATIONS ===
-        Career Goal: {career_goal}
-        Dream Company: {dream_company}
-        Company Preference: {company_preference}
-        Industries of Interest: {industries_str}
-        Personal Statement: {personal_statement[:200] if personal_statement else 'Not provided'}
-        
-        TOP SKILLS:
-        {skills_str}
-        
-        EXPERIENCE:
-        {exp_str}
-        
-        EDUCATION:
-        {edu_str}
-        
-        GITHUB PROJECTS:
-        {github_str}
-        
-        === CONVERSATION HISTORY (Memory) ===
-        {history_str}
-        
-        === USER QUESTION ===
-        "{user_query}"
-        
-        === INSTRUCTIONS ===
-        1. Address the user as "{first_name}".
-        2. Answer the user's question based on their FULL profile above, including their career aspirations.
-        3. If they ask about jobs, suggest roles that align with their Career Goal ({career_goal}) and Dream Company ({dream_company}).
-        4. Reference their GitHub projects when discussing their portfolio or technical skills.
-        5. Remember the conversation history to provide contextual, coherent responses.
-        6. Be concise (max 3 short paragraphs).
-        7. Use a warm, professional, and motivating tone.
-        8. Use formatting (bullet points, bold text) where helpful.
-        """.strip()
+    parts = (
+        PROMPT_HEADER,
+        "",
+        "=== USER PROFILE ===",
+        f"Name: {full_name}",
+        f"Headline: {headline}",
+        f"Summary: {about_summary}",
+        "",
+        "=== CAREER ASPIRATIONS ===",
+        f"Career Goal: {career_goal}",
+        f"Dream Company: {dream_company}",
+        f"Company Preference: {company_preference}",
+        f"Industries of Interest: {industries_str}",
+        f"Personal Statement: {personal_statement[:200] if personal_statement else 'Not provided'}",
+        "",
+        "TOP SKILLS:",
+        skills_str,
+        "",
+        "EXPERIENCE:",
+        exp_str,
+        "",
+        "EDUCATION:",
+        edu_str,
+        "",
+        "GITHUB PROJECTS:",
+        github_str,
+        "",
+        "=== CONVERSATION HISTORY (Memory) ===",
+        history_str,
+        "",
+        "=== USER QUESTION ===",
+        f'"{user_query}"',
+        "",
+        PROMPT_INSTRUCTIONS.format(
+            first_name=first_name, career_goal=career_goal, dream_company=dream_company
+        ),
+    )
+    return "\n".join(parts)
+
+def load_chat_context(user_id, user_query, leo_chat_history):
+    """
+    Gathers the user's profile, LinkedIn data, GitHub projects and chat history
+    and builds Leo's prompt.
+
+    Returns:
+        tuple: (prompt, conv, rich_user_data) where conv is the stored
+        conversation (or None) and rich_user_data the profile used for the prompt
+    """
+    from app.utils.llm_utils import fetch_github_projects
+
+    # --------------------------------------------------------------
+    # 1. Load the user record, LinkedIn data and chat history
+    #    concurrently (independent reads)
+    # --------------------------------------------------------------
+    user_future = _io_pool.submit(get_user_by_id, user_id)
+    linkedin_future = _io_pool.submit(get_linkedin_profile, user_id)
+    conv_future = _io_pool.submit(leo_chat_history.find_one, {"user_id": user_id}, HISTORY_PROJECTION)
+
+    # Basic user record (for fallback)
+    user_record = user_future.result() or {}
+    linkedin_url = user_record.get('linkedinProfile')
+
+    # Start the GitHub fetch now so it overlaps with the remaining reads
+    github_url = user_record.get('github_profile') or user_record.get('githubProfile')
+    github_future = _io_pool.submit(fetch_github_projects, github_url) if github_url else None
+    
+    # --------------------------------------------------------------
+    # 2. Rich scraped data, if any
+    # --------------------------------------------------------------
+    rich_user_data = linkedin_future.result()
+
+    # --------------------------------------------------------------
+    # 3. Refresh LinkedIn data in the background if it is stale;
+    #    this reply uses whatever is stored right now
+    # --------------------------------------------------------------
+    if linkedin_url:
+        schedule_linkedin_refresh(linkedin_url, user_id, rich_user_data)
+    
+    # If no scraped data, fall back to basic sign-up data
+    if not rich_user_data:
+        # Only the fields generate_prompt reads; the cached user document is never touched
+        rich_user_data = {k: user_record[k] for k in ("name", "position", "about") if k in user_record}
+        rich_user_data.update(
+            interests=user_record.get("key_interests", []),
+            experiences=(),
+            education=(),
+        )
+
+    # --------------------------------------------------------------
+    # 4. Fetch GitHub Projects
+    # --------------------------------------------------------------
+    github_projects = None
+    if github_future:
+        try:
+            github_projects = github_future.result(timeout=GITHUB_FETCH_TIMEOUT)
+            if isinstance(github_projects, str):
+                # It's an error message, log it
+                print(f"[Leo] GitHub fetch warning: {github_projects}")
+                github_projects = None
+        except Exception as e:
+            print(f"[Leo] GitHub fetch error: {e}")
+            github_projects = None
+
+    # --------------------------------------------------------------
+    # 5. Get Chat History
+    # --------------------------------------------------------------
+    conv = conv_future.result()
+    chat_history = conv.get("messages", []) if conv else []
+
+    prompt = generate_prompt(rich_user_data, user_query, chat_history, github_projects, user_record)
+    return prompt, conv, rich_user_data
+
+
+def apology_message(rich_user_data):
+    """Fallback reply used when the LLM call fails"""
+    first_name = (rich_user_data.get("name") or "there").split()[0]
+    return f"I'm sorry {first_name}, I'm having trouble thinking right now. Could you ask that again?"
+
+
+def save_chat_message(leo_chat_history, user_id, conv, user_query, raw_resp, html_resp):
+    """
+    Appends a prompt/response pair to the user's conversation.
+
+    Returns:
+        list: The most recent messages, for rendering
+    """
+    new_msg = {
+        "prompt": user_query,
+        "response": html_resp,
+        "raw_response": raw_resp,
+        "time": datetime.utcnow(),
+    }
+
+    # Append (creating the conversation on first message) in one atomic upsert;
+    # render from the history already in memory
+    leo_chat_history.update_one(
+        {"user_id": user_id},
+        {
+            "$push": {"messages": {"$each": [new_msg], "$slice": -HISTORY_STORE_LIMIT}},
+            "$setOnInsert": {"conversation_id": f"conv_{ObjectId()}"},
+        },
+        upsert=True
+    )
+    history = conv.get("messages", []) if conv else []
+    return (history + [new_msg])[-HISTORY_RENDER_LIMIT:]
+
 
 @career_coach_bp.route('/your-career_coach-leo011', methods=['POST', 'GET'])
 def career_coach():
     if "user_id" not in session:
         return redirect(url_for("auth_bp.sign_in"))
 
-    db = get_db()
-    leo_chat_history = db.career_coach
-    linkedin_coll = db.linkedin_data
+    leo_chat_history = current_app.extensions['collections']['career_coach']
 
     if request.method == 'POST':
+        from app.utils.llm_utils import get_mistral_response
+
         user_id = session['user_id']
         user_query = request.form['userQuery']
 
-        # --------------------------------------------------------------
-        # 1. Get Basic User Record (for fallback)
-        # --------------------------------------------------------------
-        user_record = get_user_by_id(user_id)
-        linkedin_url = user_record.get('linkedinProfile')
-        
-        # --------------------------------------------------------------
-        # 2. Trigger Scrape if LinkedIn URL exists (Lazy Update)
-        # --------------------------------------------------------------
-        if linkedin_url:
-            try:
-                # This checks cache age internally, so it's safe to call every time
-                fetch_linkedin_profile_brightdata(linkedin_url, user_id)
-            except Exception as e:
-                print(f"[Leo] LinkedIn fetch warning: {e}")
-
-        # --------------------------------------------------------------
-        # 3. Load Rich Data from DB
-        # --------------------------------------------------------------
-        # Try to get the rich scraped data first
-        rich_user_data = linkedin_coll.find_one({"user_id": user_id})
-        
-        # If no scraped data, fall back to basic sign-up data
-        if not rich_user_data:
-            rich_user_data = user_record or {}
-            # Normalize keys to match generate_prompt expectations
-            rich_user_data["experiences"] = []
-            rich_user_data["education"] = []
-            rich_user_data["interests"] = rich_user_data.get("key_interests", [])
-
-        # --------------------------------------------------------------
-        # 4. Fetch GitHub Projects
-        # --------------------------------------------------------------
-        github_projects = None
-        github_url = user_record.get('github_profile') or user_record.get('githubProfile')
-        if github_url:
-            try:
-                github_projects = fetch_github_projects(github_url)
-                if isinstance(github_projects, str):
-                    # It's an error message, log it
-                    print(f"[Leo] GitHub fetch warning: {github_projects}")
-                    github_projects = None
-            except Exception as e:
-                print(f"[Leo] GitHub fetch error: {e}")
-                github_projects = None
+        prompt, conv, rich_user_data = load_chat_context(user_id, user_query, leo_chat_history)
 
-        # --------------------------------------------------------------
-        # 5. Get Chat History
-        # --------------------------------------------------------------
-        conv = leo_chat_history.find_one({"user_id": user_id})
-        chat_history = conv.get("messages", []) if conv else []
-
-        # --------------------------------------------------------------
-        # 6. Generate AI Response
-        # --------------------------------------------------------------
+        # Generate AI Response
         try:
-            prompt = generate_prompt(rich_user_data, user_query, chat_history, github_projects, user_record)
             raw_resp = get_mistral_response(prompt, tokens=400)
 
             # Convert Markdown to HTML for display
-            html_resp = markdowner.convert(raw_resp)
+            html_resp = to_html(raw_resp)
         except Exception as e:
             print(f"[Leo] LLM Error: {e}")
-            first_name = rich_user_data.get("name", "there").split()[0]
-            raw_resp = f"I'm sorry {first_name}, I'm having trouble thinking right now. Could you ask that again?"
-            html_resp = markdowner.convert(raw_resp)
-
-        # --------------------------------------------------------------
-        # 6. Save Conversation
-        # --------------------------------------------------------------
-        new_msg = {
-            "prompt": user_query,
-            "response": html_resp,
-            "raw_response": raw_resp,
-            "time": datetime.utcnow(),
-        }
+            raw_resp = apology_message(rich_user_data)
+            html_resp = to_html(raw_resp)
 
-        if not conv:
-            conv_id = f"conv_{int(datetime.now().timestamp())}"
-            leo_chat_history.insert_one({
-                "user_id": user_id,
-                "conversation_id": conv_id,
-                "messages": [new_msg],
-            })
-            messages = [new_msg]
-        else:
-            # Append new message
-            leo_chat_history.update_one(
-                {"user_id": user_id},
-                {"$push": {"messages": new_msg}}
-            )
-            # Fetch updated list for rendering
-            updated_conv = leo_chat_history.find_one({"user_id": user_id})
-            messages = updated_conv.get("messages", [])
+        # Save Conversation
+        messages = save_chat_message(leo_chat_history, user_id, conv, user_query, raw_resp, html_resp)
 
         return render_template("career_coach.html", messages=messages)
 
     # GET route - Display history
-    conv = leo_chat_history.find_one({"user_id": session["user_id"]})
+    conv = leo_chat_history.find_one({"user_id": session["user_id"]}, HISTORY_PROJECTION)
     messages = conv.get("messages", []) if conv else []
 
     return render_template("career_coach.html", messages=messages)
 
 
+@career_coach_bp.route('/your-career_coach-leo011/stream', methods=['POST'])
+def career_coach_stream():
+    """
+    Streams Leo's reply as server-sent events so the first tokens reach the
+    browser while the rest is still being generated. The full reply is
+    saved once the stream finishes.
+    """
+    if "user_id" not in session:
+        return jsonify({"status": "error", "message": "Not authenticated"}), 401
+
+    from app.utils.llm_utils import get_mistral_response_stream
+
+    user_id = session['user_id']
+    user_query = request.form.get('userQuery', '').strip()
+    if not user_query:
+        return jsonify({"status": "error", "message": "Missing userQuery"}), 400
+
+    leo_chat_history = current_app.extensions['collections']['career_coach']
+    prompt, conv, rich_user_data = load_chat_context(user_id, user_query, leo_chat_history)
+
+    # App JSON provider (orjson when installed), looked up once for the whole stream
+    dumps = current_app.json.dumps
+
+    def generate():
+        chunks = []
+        try:
+            for delta in get_mistral_response_stream(prompt, tokens=400):
+                chunks.append(delta)
+                yield f"data: {dumps({'delta': delta})}\n\n"
+        finally:
+            # Persist whatever was generated, even if the client went away
+            raw_resp = "".join(chunks).strip() or apology_message(rich_user_data)
+            html_resp = to_html(raw_resp)
+            save_chat_message(leo_chat_history, user_id, conv, user_query, raw_resp, html_resp)
+        yield f"event: done\ndata: {dumps({'html': html_resp})}\n\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @career_coach_bp.route('/your-career_coach-leo011/clear', methods=['POST'])
 def clear_chat():
     """
@@ -264,16 +412,41 @@ def clear_chat():
     if "user_id" not in session:
         return redirect(url_for("auth_bp.sign_in"))
 
-    db = get_db()
-    leo_chat_history = db.career_coach
+    leo_chat_history = current_app.extensions['collections']['career_coach']
     user_id = session['user_id']
 
     try:
         # Remove the conversation document for this user (clean slate).
         leo_chat_history.delete_one({"user_id": user_id})
+        invalidate_user_cache(user_id)
     except Exception as e:
         # Log but continue — do not reveal internal error to user
         print(f"[Leo] Error clearing chat for user {user_id}: {e}")
 
     # Redirect back to the main career coach page which will render empty history
     return redirect(url_for('career_coach_bp.career_coach'))
+
+
+def backfill_rendered_responses():
+    """
+    One-off migration: store pre-rendered HTML for messages saved without it,
+    so pages never have to convert markdown at render time.
+
+    Returns:
+        int: Number of conversations updated
+    """
+    leo_chat_history = get_db().career_coach
+    updated = 0
+    # $elemMatch also catches conversations where only some messages lack HTML
+    missing = {"messages": {"$elemMatch": {"response": {"$exists": False}}}}
+    for conv in leo_chat_history.find(missing, {"messages": 1}):
+        # Set only the missing fields, leaving the rest of the array untouched
+        rendered = {
+            f"messages.{i}.response": to_html(msg.get("raw_response", ""))
+            for i, msg in enumerate(conv.get("messages", []))
+            if "response" not in msg
+        }
+        if rendered:
+            leo_chat_history.update_one({"_id": conv["_id"]}, {"$set": rendered})
+            updated += 1
+    return updated
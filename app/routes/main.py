@@ -1,54 +1,138 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
-import requests
+from flask import Blueprint, current_app, render_template, request, redirect, url_for, flash, session, jsonify
 from datetime import datetime
-import json
 import os
-from app.utils.db_utils import get_user_by_id
-from app.utils.llm_utils import get_roadmap_from_groq
-from app.utils.linkedin import fetch_linkedin_profile_brightdata
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import TTLCache
+from app.utils.db_utils import get_db, get_user_by_id, invalidate_user_cache, get_roadmap_status
+from app.utils.http_utils import SESSION
 
 # Main blueprint
 main_bp = Blueprint('main_bp', __name__)
 
+# Categories for the top section of the home and news pages
+CATEGORIES = (
+    "Blockchain", "JavaScript", "Education", "Coding", "Books", "Web Development",
+    "Marketing", "Deep Learning", "Social Media", "Software Development",
+    "Artificial Intelligence", "Culture", "React", "UX", "Software Engineering",
+    "Design", "Science", "Health", "Python", "Productivity", "Machine Learning",
+    "Writing", "Self Improvement", "Technology", "Data Science", "Programming"
+)
+
+# Medium stories barely change minute to minute; cache by (query, page, limit)
+MEDIUM_SEARCH_URL = "https://medium16.p.rapidapi.com/search/stories"
+MAX_PAGE = 100
+MAX_QUERY_LENGTH = 64
+_medium_cache = TTLCache(maxsize=256, ttl=600)
+_medium_cache_lock = threading.Lock()
+
+def fetch_medium_stories(query, page=0, limit=10):
+    """
+    Search Medium stories via RapidAPI, cached for 10 minutes.
+
+    Returns:
+        list: Story dicts (empty on error)
+    """
+    key = (query.lower(), page, limit)
+    with _medium_cache_lock:
+        cached = _medium_cache.get(key)
+    if cached is not None:
+        return cached
+
+    headers = {
+        "x-rapidapi-key": os.getenv('MEDIUM_API_KEY'),
+        "x-rapidapi-host": "medium16.p.rapidapi.com",
+    }
+    querystring = {"q": query, "limit": str(limit), "page": str(page)}
+    try:
+        response = SESSION.get(MEDIUM_SEARCH_URL, headers=headers, params=querystring, timeout=3)
+        if response.status_code != 200:
+            return []
+        stories = response.json().get("data", [])
+    except Exception as e:
+        print(f"Error fetching stories: {e}")
+        return []
+
+    with _medium_cache_lock:
+        _medium_cache[key] = stories
+    return stories
+
+# Runs the home page's independent I/O (Mongo + Medium) side by side
+_home_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="home-io")
+
+def fetch_upcoming_companies(limit=5):
+    """Next companies visiting campus, soonest first"""
+    return list(get_db().companies.find().sort("visit_date", 1).limit(limit))
+
+# Roadmap generation runs off the request thread so saving a profile returns
+# immediately; the roadmap page polls /roadmap-status until it lands. Job state
+# is kept on the user document so any worker can answer the poll.
+_roadmap_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="roadmap")
+
+# Serverless platforms freeze background threads once the response is sent, so
+# there the roadmap is generated inside the request instead
+ROADMAP_SYNC = os.getenv("ROADMAP_SYNC", "true" if os.getenv("VERCEL") else "false").lower() == "true"
+
+def pending_roadmap_status(job_id):
+    """road_map_status value for a freshly queued generation job"""
+    return {"state": "pending", "job_id": job_id, "phases_ready": 0, "updated_at": datetime.utcnow()}
+
+def generate_user_roadmap(user_id, job_id, desired_role, learning_duration, learning_duration_unit):
+    """
+    Generate a roadmap and swap it in. Every write is conditional on job_id, so a
+    job superseded by a newer profile save stops without touching the document.
+    """
+    from app.utils.llm_utils import stream_roadmap_from_groq
+    users = get_db().users
+    current_job = {"user_id": user_id, "road_map_status.job_id": job_id}
+    try:
+        # Phases arrive one by one, so the status endpoint can report progress
+        phases = []
+        for phase in stream_roadmap_from_groq(desired_role, learning_duration, learning_duration_unit):
+            phases.append(phase)
+            result = users.update_one(current_job, {"$set": {
+                "road_map_status.phases_ready": len(phases),
+                "road_map_status.updated_at": datetime.utcnow(),
+            }})
+            if result.matched_count == 0:
+                return
+
+        # The previous roadmap is only replaced once the new one is complete
+        users.update_one(current_job, {"$set": {
+            "road_map": {"phases": phases},
+            "road_map_status.state": "ready",
+            "road_map_status.updated_at": datetime.utcnow(),
+        }})
+    except Exception as e:
+        print(f"[Roadmap] Generation failed for {user_id}: {e}")
+        users.update_one(current_job, {"$set": {
+            "road_map_status.state": "failed",
+            "road_map_status.updated_at": datetime.utcnow(),
+        }})
+    finally:
+        invalidate_user_cache(user_id)
+
+def run_roadmap_job(user_id, job_id, desired_role, learning_duration, learning_duration_unit):
+    """Generate the roadmap in the background, or inline when ROADMAP_SYNC is set"""
+    args = (user_id, job_id, desired_role, learning_duration, learning_duration_unit)
+    if ROADMAP_SYNC:
+        generate_user_roadmap(*args)
+    else:
+        _roadmap_pool.submit(generate_user_roadmap, *args)
+
 @main_bp.route("/")
 @main_bp.route("/home")
 def home():
     if "user_id" in session:
-        # Categories for the top section
-        categories = [
-            "Blockchain", "JavaScript", "Education", "Coding", "Books", "Web Development",
-            "Marketing", "Deep Learning", "Social Media", "Software Development",
-            "Artificial Intelligence", "Culture", "React", "UX", "Software Engineering",
-            "Design", "Science", "Health", "Python", "Productivity", "Machine Learning",
-            "Writing", "Self Improvement", "Technology", "Data Science", "Programming"
-        ]
-
-        # Fetch companies from database
-        from app.utils.db_utils import get_db
-        db = get_db()
-        companies_collection = db.companies
-        companies = companies_collection.find().sort("visit_date", 1).limit(5)
-        selected_companies = list(companies)
-
-        # Fetch articles from Medium API
-        query = "technology"
-        page = 0
-        url = "https://medium16.p.rapidapi.com/search/stories"
-        headers = {
-            "x-rapidapi-key": os.getenv('MEDIUM_API_KEY'),
-            "x-rapidapi-host": "medium16.p.rapidapi.com",
-        }
-        querystring = {"q": query, "limit": "5", "page": str(page)}
-        
-        try:
-            response = requests.get(url, headers=headers, params=querystring)
-            articles = response.json().get("data", []) if response.status_code == 200 else []
-        except Exception as e:
-            print(f"Error fetching articles: {e}")
-            articles = []
+        # Fetch companies from database and articles from Medium API concurrently
+        companies_future = _home_pool.submit(fetch_upcoming_companies, 5)
+        articles_future = _home_pool.submit(fetch_medium_stories, "technology", 0, 5)
+        selected_companies = companies_future.result()
+        articles = articles_future.result()
 
         return render_template(
-            "home.html", categories=categories, stories=articles, companies=selected_companies
+            "home.html", categories=CATEGORIES, stories=articles, companies=selected_companies
         )
     else:
         return redirect(url_for("auth_bp.sign_in"))
@@ -56,36 +140,15 @@ def home():
 @main_bp.route("/news-articles")
 def news_article():
     if "user_id" in session:
-        # Categories for the top section
-        categories = [
-            "Blockchain", "JavaScript", "Education", "Coding", "Books", "Web Development",
-            "Marketing", "Deep Learning", "Social Media", "Software Development",
-            "Artificial Intelligence", "Culture", "React", "UX", "Software Engineering",
-            "Design", "Science", "Health", "Python", "Productivity", "Machine Learning",
-            "Writing", "Self Improvement", "Technology", "Data Science", "Programming"
-        ]
-
         # Get query parameters for topic and pagination
-        query = request.args.get("q", "technology")
-        page = int(request.args.get("page", 0))
+        query = (request.args.get("q", "technology").strip() or "technology")[:MAX_QUERY_LENGTH]
+        page = max(0, min(request.args.get("page", 0, type=int), MAX_PAGE))
 
         # API Request
-        url = "https://medium16.p.rapidapi.com/search/stories"
-        headers = {
-            "x-rapidapi-key": os.getenv('MEDIUM_API_KEY'),
-            "x-rapidapi-host": "medium16.p.rapidapi.com",
-        }
-        querystring = {"q": query, "limit": "10", "page": str(page)}
-        
-        try:
-            response = requests.get(url, headers=headers, params=querystring)
-            stories = response.json().get("data", []) if response.status_code == 200 else []
-        except Exception as e:
-            print(f"Error fetching stories: {e}")
-            stories = []
+        stories = fetch_medium_stories(query, page=page, limit=10)
 
         return render_template(
-            "news_articles.html", stories=stories, query=query, page=page, categories=categories
+            "news_articles.html", stories=stories, query=query, page=page, categories=CATEGORIES
         )
     else:
         return redirect(url_for("auth_bp.sign_in"))
@@ -102,9 +165,8 @@ def get_notifications():
     if "user_id" not in session:
         return jsonify([])
     
-    from app.utils.db_utils import get_db
-    db = get_db()
-    notifications = list(db.notifications.find(
+    cols = current_app.extensions['collections']
+    notifications = list(cols['notifications'].find(
         {"user_id": session["user_id"], "read": False}
     ).sort("created_at", -1).limit(5))
     
@@ -118,12 +180,13 @@ def student_profile():
     if "user_id" not in session:
         return redirect(url_for("auth_bp.sign_in"))
 
-    from app.utils.db_utils import get_db
-    db = get_db()
-    user_collection = db.users
-    linkedin_data_collection = db.linkedin_data
+    cols = current_app.extensions['collections']
+    user_collection = cols['users']
+    linkedin_data_collection = cols['linkedin_data']
 
     if request.method == 'POST':
+        from app.utils.linkedin import fetch_linkedin_profile_brightdata
+
         user_id = session['user_id']
         existing_profile = user_collection.find_one({"user_id": user_id})
         if not existing_profile:
@@ -173,15 +236,22 @@ def student_profile():
             desired_role = updated_profile.get('career_goal', 'Software Developer')
             learning_duration = updated_profile.get('learning_duration')
             learning_duration_unit = updated_profile.get('learning_duration_unit', 'months')
-            roadmap_data = get_roadmap_from_groq(desired_role, learning_duration, learning_duration_unit)
-            updated_profile['road_map'] = json.dumps(roadmap_data)
+            updated_profile.pop('road_map', None)
+            updated_profile.pop('road_map_status', None)
 
-            update_op = {"$set": updated_profile}
+            # The current roadmap stays until the job writes its replacement
+            job_id = uuid.uuid4().hex
+            update_op = {"$set": {**updated_profile, "road_map_status": pending_roadmap_status(job_id)}}
             if key_fields_updated:
                 update_op["$unset"] = {"active_modules": ""}
 
             user_collection.update_one({"user_id": user_id}, update_op)
-            flash("Profile updated successfully!", "success")
+            invalidate_user_cache(user_id)
+            run_roadmap_job(user_id, job_id, desired_role, learning_duration, learning_duration_unit)
+            if ROADMAP_SYNC:
+                flash("Profile updated successfully! Your roadmap has been updated.", "success")
+            else:
+                flash("Profile updated successfully! Your roadmap is being generated.", "success")
             return redirect(url_for('main_bp.student_profile'))
 
         except Exception as e:
@@ -189,4 +259,13 @@ def student_profile():
             return redirect(url_for('main_bp.student_profile'))
 
     profile = user_collection.find_one({"user_id": session["user_id"]}) or {}
-    return render_template('student_profile.html', profile=profile, user=profile)
\ No newline at end of file
+    return render_template('student_profile.html', profile=profile, user=profile)
+
+@main_bp.route('/roadmap-status')
+def roadmap_status():
+    """Report whether the user's roadmap is still being generated"""
+    if "user_id" not in session:
+        return jsonify({"status": "error", "message": "Not authenticated"}), 401
+
+    state, phases_ready = get_roadmap_status(session["user_id"])
+    return jsonify({"status": state, "phases_ready": phases_ready})
@@ -1,8 +1,6 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
-import json
+from flask import Blueprint, current_app, render_template, request, redirect, url_for, flash, session, jsonify
 from datetime import datetime
-from app.utils.db_utils import get_db, get_user_by_id
-from app.utils.llm_utils import generate_learning_plan
+from app.utils.db_utils import get_user_with_roadmap, invalidate_user_cache, load_roadmap, ensure_roadmap_document, get_roadmap_status
 
 # Create a blueprint for roadmap routes
 roadmap_bp = Blueprint('roadmap_bp', __name__)
@@ -14,7 +12,7 @@ def roadmap():
         return redirect(url_for("auth_bp.sign_in"))
     
     # Get user data
-    user = get_user_by_id(session["user_id"])
+    user = get_user_with_roadmap(session["user_id"])
     if not user:
         return redirect(url_for("auth_bp.sign_in"))
     
@@ -23,10 +21,13 @@ def roadmap():
     has_career_goal = bool(career_goal)
     
     # Get roadmap data
-    roadmap_data = json.loads(user.get('road_map', '{}'))
+    roadmap_data = load_roadmap(user)
     
     # Check if roadmap exists
     has_roadmap = roadmap_data and 'phases' in roadmap_data
+
+    # A regeneration may be running while the previous roadmap is still shown
+    roadmap_state, _ = get_roadmap_status(session["user_id"])
     
     # Render template with status flags
     return render_template(
@@ -35,6 +36,7 @@ def roadmap():
         user=user,
         has_career_goal=has_career_goal,
         has_roadmap=has_roadmap,
+        roadmap_pending=roadmap_state == "pending",
         career_goal=career_goal
     )
 
@@ -45,12 +47,12 @@ def generate_plan(phase_id):
         return jsonify({"status": "error", "message": "Not authenticated"}), 401
     
     # Get user data
-    user = get_user_by_id(session["user_id"])
+    user = get_user_with_roadmap(session["user_id"])
     if not user:
         return jsonify({"status": "error", "message": "User not found"}), 404
     
     # Get roadmap data
-    roadmap_data = json.loads(user.get('road_map', '{}'))
+    roadmap_data = load_roadmap(user)
     
     # Check if phase exists
     try:
@@ -74,29 +76,86 @@ def generate_plan(phase_id):
         return jsonify({"status": "error", "message": "Missing phase name or skills"}), 400
     
     try:
+        from app.utils.llm_utils import generate_learning_plan
+
         # Generate the learning plan
         learning_plan = generate_learning_plan(phase_name, skills)
         
-        # Add the learning plan to the phase
-        phase['learning_plan'] = learning_plan
-        
         # Mark all tasks as not completed
         for week in learning_plan.get('weekly_schedule', []):
             for task in week.get('daily_tasks', []):
                 task['completed'] = False
         
-        # Update the user's roadmap in the database
-        db = get_db()
-        db.users.update_one(
+        # Write only this phase's learning plan into the stored roadmap
+        ensure_roadmap_document(user)
+        cols = current_app.extensions['collections']
+        cols['users'].update_one(
             {"user_id": session["user_id"]},
-            {"$set": {"road_map": json.dumps(roadmap_data)}}
+            {"$set": {f"road_map.phases.{phase_id_int}.learning_plan": learning_plan}}
         )
+        invalidate_user_cache(session["user_id"])
         
         return jsonify({"status": "success", "message": "Learning plan generated"})
     
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@roadmap_bp.route('/generate-all-plans', methods=['POST'])
+def generate_all_plans():
+    """Generate learning plans for every phase that is missing one, in a single LLM call"""
+    if "user_id" not in session:
+        return jsonify({"status": "error", "message": "Not authenticated"}), 401
+
+    # Get user data
+    user = get_user_with_roadmap(session["user_id"])
+    if not user:
+        return jsonify({"status": "error", "message": "User not found"}), 404
+
+    # Get roadmap data
+    roadmap_data = load_roadmap(user)
+    phases = roadmap_data.get('phases', []) if isinstance(roadmap_data, dict) else []
+
+    # Only phases with a name and skills but no plan yet
+    missing = [
+        i for i, phase in enumerate(phases)
+        if not phase.get('learning_plan') and phase.get('name') and phase.get('skills')
+    ]
+    if not missing:
+        return jsonify({"status": "exists", "message": "All learning plans already exist"})
+
+    try:
+        from app.utils.llm_utils import generate_learning_plans_batch
+
+        # Generate all missing learning plans with one prompt
+        plans = generate_learning_plans_batch([phases[i] for i in missing])
+
+        # Mark all tasks as not completed
+        for learning_plan in plans:
+            for week in learning_plan.get('weekly_schedule', []):
+                for task in week.get('daily_tasks', []):
+                    task['completed'] = False
+
+        # Write every new plan into the stored roadmap in one update
+        ensure_roadmap_document(user)
+        cols = current_app.extensions['collections']
+        cols['users'].update_one(
+            {"user_id": session["user_id"]},
+            {"$set": {
+                f"road_map.phases.{i}.learning_plan": learning_plan
+                for i, learning_plan in zip(missing, plans)
+            }}
+        )
+        invalidate_user_cache(session["user_id"])
+
+        return jsonify({
+            "status": "success",
+            "message": f"Generated {len(plans)} learning plans",
+            "phases": missing
+        })
+
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
 @roadmap_bp.route('/learning-plan/<string:phase_id>')
 def learning_plan(phase_id):
     """Render the learning plan page for a specific phase"""
@@ -104,12 +163,12 @@ def learning_plan(phase_id):
         return redirect(url_for("auth_bp.sign_in"))
     
     # Get user data
-    user = get_user_by_id(session["user_id"])
+    user = get_user_with_roadmap(session["user_id"])
     if not user:
         return redirect(url_for("auth_bp.sign_in"))
     
     # Get roadmap data
-    roadmap_data = json.loads(user.get('road_map', '{}'))
+    roadmap_data = load_roadmap(user)
     
     # Check if phase exists
     try:
@@ -119,12 +178,13 @@ def learning_plan(phase_id):
         
         phase = roadmap_data['phases'][phase_id_int]
     except (ValueError, IndexError, KeyError):
-        return redirect(url_for("roadmap.roadmap"))
+        return redirect(url_for("roadmap_bp.roadmap"))
     
     # Check if learning plan exists
     if not phase.get('learning_plan'):
-        # Generate learning plan
-        return redirect(url_for("roadmap_bp.generate_plan", phase_id=phase_id))
+        # generate_plan is POST-only; plans are generated from the roadmap page
+        flash("Generate the learning plan for this phase first.", "info")
+        return redirect(url_for("roadmap_bp.roadmap"))
     
     # Add the user object and phase ID to the template context
     return render_template('learning_plan.html', phase=phase, user=user, phase_id=phase_id)
@@ -135,38 +195,48 @@ def complete_task():
     if "user_id" not in session:
         return jsonify({"status": "error", "message": "Not authenticated"}), 401
     
-    data = request.json
+    data = request.get_json(silent=True) or {}
     phase_id = data.get('phase_id')
     week_index = data.get('week_index')
     day_index = data.get('day_index')
-    completed = data.get('completed', False)
+    completed = bool(data.get('completed', False))
     
-    if not all([phase_id, week_index, day_index]):
+    # Index 0 is valid, so only reject values that are actually missing
+    if phase_id is None or week_index is None or day_index is None:
         return jsonify({"status": "error", "message": "Missing required parameters"}), 400
     
     try:
-        # Get user data
-        user = get_user_by_id(session["user_id"])
-        if not user:
-            return jsonify({"status": "error", "message": "User not found"}), 404
-        
-        # Get roadmap data
-        roadmap_data = json.loads(user.get('road_map', '{}'))
-        
-        # Update the task completion status
-        phase = roadmap_data['phases'][int(phase_id)]
-        weekly_schedule = phase['learning_plan']['weekly_schedule']
-        task = weekly_schedule[int(week_index)]['daily_tasks'][int(day_index)]
-        task['completed'] = completed
-        
-        # Update the database
-        db = get_db()
-        db.users.update_one(
-            {"user_id": session["user_id"]},
-            {"$set": {"road_map": json.dumps(roadmap_data)}}
+        phase_idx, week_idx, day_idx = int(phase_id), int(week_index), int(day_index)
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "message": "Invalid task index"}), 400
+    if min(phase_idx, week_idx, day_idx) < 0:
+        return jsonify({"status": "error", "message": "Invalid task index"}), 400
+    
+    user_id = session["user_id"]
+    users = current_app.extensions['collections']['users']
+    task_path = f"road_map.phases.{phase_idx}.learning_plan.weekly_schedule.{week_idx}.daily_tasks.{day_idx}"
+    
+    def mark_task():
+        # Only matches when the task exists, so the roadmap never has to be read
+        return users.update_one(
+            {"user_id": user_id, task_path: {"$exists": True}},
+            {"$set": {f"{task_path}.completed": completed}}
         )
+    
+    try:
+        result = mark_task()
+        if result.matched_count == 0:
+            # Legacy JSON-string roadmaps can't be addressed by path: convert once and retry
+            user = get_user_with_roadmap(user_id)
+            if user and isinstance(user.get("road_map"), str):
+                ensure_roadmap_document(user)
+                result = mark_task()
         
+        if result.matched_count == 0:
+            return jsonify({"status": "error", "message": "Task not found"}), 404
+        
+        invalidate_user_cache(user_id)
         return jsonify({"status": "success", "message": "Task updated"})
     
     except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 500
\ No newline at end of file
+        return jsonify({"status": "error", "message": str(e)}), 500
@@ -1,17 +1,76 @@
-from flask import Blueprint, render_template, request, redirect, url_for, jsonify, session
-import json
+from flask import Blueprint, Response, current_app, render_template, request, redirect, url_for, jsonify, session, stream_with_context
 import os
-from app.utils.db_utils import get_db, get_user_by_id
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from app.utils.db_utils import get_user_by_id, get_roadmap_phase
 from app.utils.resource_utils import (
     fetch_youtube_videos,
     fetch_google_scholar_papers,
-    fetch_google_search_results
+    fetch_google_search_results,
+    get_cached_resources,
+    cache_resources
 )
-from app.utils.llm_utils import get_groq_response
 
 # Create a Blueprint for the tutor routes
 tutor_bp = Blueprint('tutor_bp', __name__)
 
+# Messages sent to the model as context, and kept per module in MongoDB
+TUTOR_CONTEXT_MESSAGES = 10
+TUTOR_HISTORY_LIMIT = 200
+
+# Chat history writes happen off the request path
+persistence_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="tutor-persist")
+
+# Resource APIs (YouTube, Scholar, web search) are queried concurrently
+resource_pool = ThreadPoolExecutor(max_workers=12, thread_name_prefix="tutor-resources")
+RESOURCE_FETCH_TIMEOUT = 15
+
+# Bulkhead: at most this many fetches running or queued; past that a source is
+# skipped at once instead of queueing behind a slow upstream
+RESOURCE_MAX_PENDING = 36
+_resource_slots = threading.BoundedSemaphore(RESOURCE_MAX_PENDING)
+
+def submit_resource_fetch(fn, *args, **kwargs):
+    """Run a resource fetcher on resource_pool; returns None if the pool is saturated"""
+    if not _resource_slots.acquire(blocking=False):
+        return None
+    try:
+        future = resource_pool.submit(fn, *args, **kwargs)
+    except Exception:
+        _resource_slots.release()
+        raise
+    future.add_done_callback(lambda _: _resource_slots.release())
+    return future
+
+def module_history_projection(module_key, limit=None):
+    """Projection that returns only one module's chat history (optionally just the last `limit` messages)"""
+    field = f"modules.{module_key}"
+    return {"_id": 0, "user_id": 1, field: {"$slice": -limit} if limit else 1}
+
+def get_phase_and_module(user_id, phase_id, module_id):
+    """
+    Look up a roadmap phase and one of its weekly modules (module_id is 1-based).
+    The phase is always read from MongoDB with a $slice projection.
+    
+    Returns:
+        tuple: (phase, module), or (None, None) if either doesn't exist
+    """
+    try:
+        phase_idx, module_idx = int(phase_id), int(module_id) - 1
+    except (TypeError, ValueError):
+        return None, None
+    if module_idx < 0:
+        return None, None
+    
+    phase = get_roadmap_phase(user_id, phase_idx)
+    if not phase:
+        return None, None
+    weeks = (phase.get('learning_plan') or {}).get('weekly_schedule') or []
+    if module_idx >= len(weeks):
+        return None, None
+    return phase, weeks[module_idx]
+
 @tutor_bp.route('/tutor/<string:phase_id>/<string:module_id>', methods=['GET'])
 def tutor_page(phase_id, module_id):
     """
@@ -29,42 +88,27 @@ def tutor_page(phase_id, module_id):
     if not user:
         return redirect(url_for("auth_bp.sign_in"))
     
-    # Get roadmap data
-    roadmap_data = json.loads(user.get('road_map', '{}'))
-    
-    # Get specific phase data
-    phase = None
-    try:
-        phase = roadmap_data['phases'][int(phase_id)]
-    except (IndexError, KeyError, ValueError):
-        return redirect(url_for("roadmap_bp.roadmap"))
-    
-    # Get learning plan data if available
-    learning_plan = phase.get('learning_plan', {})
-    
-    # Get the specific module (weekly schedule)
-    module = None
-    try:
-        module = learning_plan['weekly_schedule'][int(module_id) - 1]
-    except (IndexError, KeyError, ValueError):
-        # If module doesn't exist, redirect to roadmap
+    # Get the phase and the specific module (weekly schedule)
+    phase, module = get_phase_and_module(session["user_id"], phase_id, module_id)
+    if module is None:
+        # If the phase or module doesn't exist, redirect to roadmap
         return redirect(url_for("roadmap_bp.roadmap"))
     
     # Prepare initial resources
     topic = f"{phase['name']} - Week {module['week']}: {', '.join(module['learning_objectives'])}"
     
     # Get chat history if exists - use the new nested structure
-    db = get_db()
-    chat_history_doc = db.user_chat_histories.find_one({
-        "user_id": session["user_id"]
-    })
+    module_key = f"{phase_id}_{module_id}"
+    cols = current_app.extensions['collections']
+    chat_history_doc = cols['user_chat_histories'].find_one(
+        {"user_id": session["user_id"]},
+        module_history_projection(module_key)
+    )
     
     chat_history = []
     if chat_history_doc:
         # Get the specific module history from the nested structure
-        module_key = f"{phase_id}_{module_id}"
-        if module_key in chat_history_doc.get('modules', {}):
-            chat_history = chat_history_doc['modules'][module_key]
+        chat_history = chat_history_doc.get('modules', {}).get(module_key, [])
     
     return render_template(
         'tutor.html',
@@ -77,6 +121,75 @@ def tutor_page(phase_id, module_id):
         chat_history=chat_history
     )
 
+def prepare_tutor_turn(phase, module, user_id, message, phase_id, module_id):
+    """
+    Gather what the tutor needs to answer a message in a module.
+    
+    Returns:
+        tuple: (module_key, user_message, llm_kwargs) where llm_kwargs are the
+        arguments for get_groq_response / get_groq_response_stream
+    """
+    # Create module key for storage
+    module_key = f"{phase_id}_{module_id}"
+    
+    # Only the recent messages needed for context; with the new one that fills the window
+    cols = current_app.extensions['collections']
+    chat_history_doc = cols['user_chat_histories'].find_one(
+        {"user_id": user_id},
+        module_history_projection(module_key, TUTOR_CONTEXT_MESSAGES - 1)
+    ) or {}
+    previous_messages = chat_history_doc.get('modules', {}).get(module_key, [])
+    
+    # Create user message object
+    user_message = {
+        "role": "user",
+        "content": message,
+        "timestamp": datetime.now()
+    }
+    
+    # Prior turns only: the LLM helpers append the new message themselves
+    conversation_context = [
+        {"role": msg["role"], "content": msg["content"]}
+        for msg in previous_messages
+    ]
+    
+    # Prepare context for the AI
+    llm_kwargs = {
+        "message": message,
+        "topic": f"{phase['name']} - Week {module['week']}",
+        "objectives": module['learning_objectives'],
+        "skills": phase.get('skills', []),
+        "resources": phase.get('resources', {}),
+        "conversation_context": conversation_context
+    }
+    return module_key, user_message, llm_kwargs
+
+def _persist_chat(chat_histories, user_id, module_key, user_message, assistant_message):
+    """Append both messages to the module's history in one atomic write (runs in the background)"""
+    try:
+        chat_histories.update_one(
+            {"user_id": user_id},
+            {"$push": {f"modules.{module_key}": {
+                "$each": [user_message, assistant_message],
+                "$slice": -TUTOR_HISTORY_LIMIT
+            }}},
+            upsert=True
+        )
+    except Exception as e:
+        print(f"[Tutor] Failed to save chat for {user_id}: {e}")
+
+def save_tutor_messages(user_id, module_key, user_message, ai_response):
+    """Queue a user message and the tutor's reply to be saved without blocking the response"""
+    assistant_message = {
+        "role": "assistant",
+        "content": ai_response,
+        "timestamp": datetime.now()
+    }
+    chat_histories = current_app.extensions['collections']['user_chat_histories']
+    persistence_executor.submit(
+        _persist_chat, chat_histories, user_id, module_key, user_message, assistant_message
+    )
+
 @tutor_bp.route('/api/tutor/chat', methods=['POST'])
 def tutor_chat():
     """API endpoint for the tutor chat functionality"""
@@ -91,96 +204,22 @@ def tutor_chat():
     if not all([message, phase_id, module_id]):
         return jsonify({"status": "error", "message": "Missing required parameters"}), 400
     
-    # Get user data
-    user = get_user_by_id(session["user_id"])
-    if not user:
-        return jsonify({"status": "error", "message": "User not found"}), 404
-    
-    # Get roadmap data to provide context
-    roadmap_data = json.loads(user.get('road_map', '{}'))
+    # Only the phase and module being studied are needed for context
+    phase, module = get_phase_and_module(session["user_id"], phase_id, module_id)
+    if module is None:
+        return jsonify({"status": "error", "message": "Module not found"}), 404
     
     try:
-        # Get phase and module data
-        phase = roadmap_data['phases'][int(phase_id)]
-        learning_plan = phase.get('learning_plan', {})
-        module = learning_plan['weekly_schedule'][int(module_id) - 1]
-        
-        # Create module key for storage
-        module_key = f"{phase_id}_{module_id}"
-        
-        # Get the current chat history for this module
-        db = get_db()
-        chat_history_doc = db.user_chat_histories.find_one({
-            "user_id": session["user_id"]
-        })
-        
-        # Initialize chat history structure if it doesn't exist
-        if not chat_history_doc:
-            chat_history_doc = {
-                "user_id": session["user_id"],
-                "modules": {}
-            }
-        
-        # Initialize module chat history if it doesn't exist
-        if 'modules' not in chat_history_doc:
-            chat_history_doc['modules'] = {}
-            
-        if module_key not in chat_history_doc['modules']:
-            chat_history_doc['modules'][module_key] = []
-        
-        # Create user message object
-        user_message = {
-            "role": "user",
-            "content": message,
-            "timestamp": datetime.now()
-        }
-        
-        # Add user message to history
-        chat_history_doc['modules'][module_key].append(user_message)
-        
-        # Get previous messages for context (last 10)
-        previous_messages = chat_history_doc['modules'][module_key][-10:] if len(chat_history_doc['modules'][module_key]) > 0 else []
-        
-        # Create conversation context
-        conversation_context = []
-        for msg in previous_messages:
-            conversation_context.append({
-                "role": msg["role"],
-                "content": msg["content"]
-            })
-        
-        # Prepare context for the AI
-        topic = f"{phase['name']} - Week {module['week']}"
-        objectives = module['learning_objectives']
-        skills = phase.get('skills', [])
-        resources = phase.get('resources', {})
-        
-        # Get response from Groq
-        ai_response = get_groq_response(
-            message=message,
-            topic=topic,
-            objectives=objectives,
-            skills=skills,
-            resources=resources,
-            conversation_context=conversation_context
+        module_key, user_message, llm_kwargs = prepare_tutor_turn(
+            phase, module, session["user_id"], message, phase_id, module_id
         )
         
-        # Create AI response object
-        assistant_message = {
-            "role": "assistant",
-            "content": ai_response,
-            "timestamp": datetime.now()
-        }
-        
-        # Add assistant message to history
-        chat_history_doc['modules'][module_key].append(assistant_message)
+        # Get response from Groq
+        from app.utils.llm_utils import get_groq_response
+        ai_response = get_groq_response(**llm_kwargs)
         
         # Update the database
-        db.user_chat_histories.update_one(
-            {"user_id": session["user_id"]},
-            {"$set": chat_history_doc},
-            upsert=True
-        )
+        save_tutor_messages(session["user_id"], module_key, user_message, ai_response)
         
         return jsonify({
             "status": "success",
@@ -192,6 +231,61 @@ def tutor_chat():
         traceback.print_exc()
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@tutor_bp.route('/api/tutor/chat/stream', methods=['POST'])
+def tutor_chat_stream():
+    """
+    Streams the tutor's reply as server-sent events. Both messages are saved
+    once the stream finishes (or the client disconnects).
+    """
+    if "user_id" not in session:
+        return jsonify({"status": "error", "message": "Not authenticated"}), 401
+    
+    data = request.get_json(silent=True) or {}
+    message = data.get('message')
+    phase_id = data.get('phase_id')
+    module_id = data.get('module_id')
+    
+    if not all([message, phase_id, module_id]):
+        return jsonify({"status": "error", "message": "Missing required parameters"}), 400
+    
+    user_id = session["user_id"]
+    phase, module = get_phase_and_module(user_id, phase_id, module_id)
+    if module is None:
+        return jsonify({"status": "error", "message": "Module not found"}), 404
+    
+    try:
+        module_key, user_message, llm_kwargs = prepare_tutor_turn(
+            phase, module, user_id, message, phase_id, module_id
+        )
+    except (KeyError, TypeError):
+        return jsonify({"status": "error", "message": "Invalid phase or module"}), 400
+    
+    from app.utils.llm_utils import get_groq_response_stream
+    
+    # App JSON provider (orjson when installed), looked up once for the whole stream
+    dumps = current_app.json.dumps
+
+    def generate():
+        chunks = []
+        try:
+            for delta in get_groq_response_stream(**llm_kwargs):
+                chunks.append(delta)
+                yield f"data: {dumps({'delta': delta})}\n\n"
+        finally:
+            # Persist whatever was generated, even if the client went away
+            ai_response = "".join(chunks).strip() or "Sorry, I couldn't respond. Try again!"
+            save_tutor_messages(user_id, module_key, user_message, ai_response)
+        if not chunks:
+            # The apology was saved as this turn; show it rather than have the client retry
+            yield f"event: error\ndata: {dumps({'message': ai_response})}\n\n"
+        yield "event: done\ndata: {}\n\n"
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @tutor_bp.route('/api/tutor/resources', methods=['GET'])
 def get_resources():
     """API endpoint to get resources for a specific topic"""
@@ -205,22 +299,34 @@ def get_resources():
         return jsonify({"status": "error", "message": "Missing topic parameter"}), 400
     
     try:
-        results = {}
-        
-        if resource_type in ['all', 'youtube']:
-            # Fetch YouTube videos
-            youtube_results = fetch_youtube_videos(topic, max_results=5)
-            results['youtube'] = youtube_results
-        
-        if resource_type in ['all', 'papers']:
-            # Fetch Google Scholar papers
-            papers = fetch_google_scholar_papers(topic, max_results=5)
-            results['papers'] = papers
+        # YouTube videos, Google Scholar papers and general web resources,
+        # fetched side by side so 'all' takes as long as the slowest source
+        fetchers = {
+            'youtube': fetch_youtube_videos,
+            'papers': fetch_google_scholar_papers,
+            'web': fetch_google_search_results,
+        }
+        wanted = [name for name in fetchers if resource_type in ('all', name)]
         
-        if resource_type in ['all', 'web']:
-            # Fetch general web resources
-            web_resources = fetch_google_search_results(topic, max_results=5)
-            results['web'] = web_resources
+        # Only sources without a fresh cached answer hit the external APIs
+        results = get_cached_resources(topic, wanted)
+        futures = {
+            name: submit_resource_fetch(fetchers[name], topic, max_results=5)
+            for name in wanted if name not in results
+        }
+        fetched = {}
+        for name, future in futures.items():
+            if future is None:
+                print(f"[Tutor] {name} resources skipped: fetch pool saturated")
+                fetched[name] = []
+                continue
+            try:
+                fetched[name] = future.result(timeout=RESOURCE_FETCH_TIMEOUT)
+            except Exception as e:
+                print(f"[Tutor] {name} resources failed: {e}")
+                fetched[name] = []
+        cache_resources(topic, fetched)
+        results.update(fetched)
         
         return jsonify({
             "status": "success",
@@ -230,9 +336,6 @@ def get_resources():
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
-# Import at the top
-from datetime import datetime
-
 @tutor_bp.route('/api/tutor/clear-history', methods=['POST'])
 def clear_chat_history():
     """Clear the chat history for a specific module"""
@@ -251,9 +354,9 @@ def clear_chat_history():
         module_key = f"{phase_id}_{module_id}"
         
         # Clear chat history for this module
-        db = get_db()
+        cols = current_app.extensions['collections']
         
-        result = db.user_chat_histories.update_one(
+        result = cols['user_chat_histories'].update_one(
             {"user_id": session["user_id"]},
             {"$set": {f"modules.{module_key}": []}}
         )
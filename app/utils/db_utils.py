@@ -1,9 +1,13 @@
 from pymongo import MongoClient
+from pymongo.errors import ConnectionFailure
 from werkzeug.security import generate_password_hash, check_password_hash
 import os
 from dotenv import load_dotenv
 import datetime
+import json
+import threading
 from bson import ObjectId
+from cachetools import TTLCache
 import bcrypt
 
 # Load environment variables
@@ -13,16 +17,75 @@ load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
 DB_NAME = os.getenv("DB_NAME", "catalyst_ai_db")
 
-# MongoDB client initialization
-def get_db():
-    """Get database connection"""
-    client = MongoClient(MONGO_URI)
-    return client[DB_NAME]
+# bcrypt work factor; existing hashes are upgraded on the next successful login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
 
-# Get initialized connection
-client = MongoClient(MONGO_URI)
+# Single process-wide client; pymongo pools connections across requests/threads.
+# connect=False defers connecting until first use so forked workers don't share sockets.
+client = MongoClient(
+    MONGO_URI,
+    maxPoolSize=int(os.getenv("MONGO_MAX_POOL_SIZE", "50")),
+    minPoolSize=int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+    waitQueueTimeoutMS=int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000")),
+    connect=False,
+)
 db = client[DB_NAME]
 
+def get_db():
+    """Get database connection (shared, pooled)"""
+    return db
+
+# Collections the views use; handles are created once and shared by every request
+COLLECTION_NAMES = ("users", "career_coach", "linkedin_data", "notifications", "companies", "user_chat_histories")
+
+def get_collections():
+    """Map of collection name -> pooled collection handle"""
+    return {name: db[name] for name in COLLECTION_NAMES}
+
+# (collection, keys, options) for every index the app relies on
+INDEXES = (
+    ("users", "user_id", {"unique": True}),
+    ("users", "email", {"unique": True}),
+    ("career_coach", "user_id", {"unique": True}),
+    ("linkedin_data", "user_id", {"unique": True}),
+    # Covers the LinkedIn freshness check (user_id -> last_updated)
+    ("linkedin_data", [("user_id", 1), ("last_updated", 1)], {}),
+    ("user_chat_histories", "user_id", {"unique": True}),
+    # Unread notifications, newest first: served straight from the index
+    ("notifications", [("user_id", 1), ("read", 1), ("created_at", -1)], {}),
+    # All notifications, newest first (get_user_notifications with unread_only=False)
+    ("notifications", [("user_id", 1), ("created_at", -1)], {}),
+    ("companies", [("visit_date", 1)], {}),
+    # Shared LLM results expire after a week
+    ("llm_cache", "created_at", {"expireAfterSeconds": 7 * 24 * 3600}),
+    # Tutor resource results are removed once expires_at passes
+    ("resource_cache", "expires_at", {"expireAfterSeconds": 0}),
+)
+
+def ensure_indexes():
+    """Create the indexes backing the hot lookups and sorted listings (idempotent)"""
+    for collection, keys, options in INDEXES:
+        # One failure (e.g. duplicate user_ids blocking a unique index) shouldn't skip the rest
+        try:
+            db[collection].create_index(keys, **options)
+        except ConnectionFailure as e:
+            # Unreachable server: every remaining index would wait out the same timeout
+            print(f"[DB] Skipping index creation, MongoDB unreachable: {e}")
+            return
+        except Exception as e:
+            print(f"[DB] Index creation failed for {collection} {keys}: {e}")
+
+# Process-local cache for hot user_id lookups (short TTL, invalidated on writes)
+_user_cache = TTLCache(maxsize=1024, ttl=60)
+_linkedin_cache = TTLCache(maxsize=1024, ttl=60)
+_cache_lock = threading.Lock()
+
+def invalidate_user_cache(user_id):
+    """Drop cached user and LinkedIn documents for a user"""
+    with _cache_lock:
+        _user_cache.pop(user_id, None)
+        _linkedin_cache.pop(user_id, None)
+
 # User authentication functions
 def check_existing_user(email, username):
     """Check if a user with the given email or username already exists"""
@@ -34,39 +97,177 @@ def insert_user(user_data):
 
 def find_user_by_credentials(email_or_user_id):
     """Find a user by email or user ID"""
-    return db.users.find_one({"$or": [{"email": email_or_user_id}, {"user_id": email_or_user_id}]})
+    # Both fields are stored lowercased; two indexed point lookups instead of an $or
+    login = email_or_user_id.strip().lower()
+    if "@" in login:
+        return db.users.find_one({"email": login}) or db.users.find_one({"user_id": login})
+    return db.users.find_one({"user_id": login}) or db.users.find_one({"email": login})
 
 def hash_password(password):
     """Hash a password using bcrypt"""
-    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode("utf-8")
 
 def verify_password(provided_password, stored_password):
     """Verify a password against stored hash"""
-    return bcrypt.checkpw(provided_password.encode(), stored_password.encode())
+    try:
+        return bcrypt.checkpw(provided_password.encode(), stored_password.encode())
+    except ValueError:
+        # Malformed or non-bcrypt hash
+        return False
+
+def password_needs_rehash(stored_password):
+    """Check whether a stored hash was made with a different bcrypt cost"""
+    try:
+        # Hash format: $2b$<cost>$<salt+hash>
+        return int(stored_password.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+# Roadmap and plan progress change underneath other workers' caches, so they are
+# never cached; views that need them read the user with get_user_with_roadmap
+ROADMAP_FIELDS = ("road_map", "road_map_status", "active_modules")
+_CACHED_USER_PROJECTION = {field: 0 for field in ROADMAP_FIELDS}
 
 # User profile functions
 def get_user_by_id(user_id):
-    """Get user by user_id"""
+    """Get user profile by user_id, without roadmap state (cached for a short TTL)"""
+    with _cache_lock:
+        user = _user_cache.get(user_id)
+    if user is None:
+        user = db.users.find_one({"user_id": user_id}, _CACHED_USER_PROJECTION)
+        if user is not None:
+            with _cache_lock:
+                _user_cache[user_id] = user
+    return user
+
+def get_user_with_roadmap(user_id):
+    """Get the full user document, roadmap included, straight from MongoDB (uncached)"""
     return db.users.find_one({"user_id": user_id})
 
+# Fields of the scraped LinkedIn document that Leo's prompt actually reads;
+# arrays are trimmed server-side instead of shipping the whole scrape
+LINKEDIN_PROMPT_PROJECTION = {
+    "_id": 0,
+    "name": 1,
+    "position": 1,
+    "about": 1,
+    "interests": 1,
+    "key_interests": 1,
+    "experiences": {"$slice": 3},
+    "education": {"$slice": 2},
+    "last_updated": 1,
+}
+
+def get_linkedin_profile(user_id):
+    """Get the cached LinkedIn profile fields used for Leo's prompt"""
+    with _cache_lock:
+        profile = _linkedin_cache.get(user_id)
+    if profile is None:
+        profile = db.linkedin_data.find_one({"user_id": user_id}, LINKEDIN_PROMPT_PROJECTION)
+        if profile is not None:
+            with _cache_lock:
+                _linkedin_cache[user_id] = profile
+    return profile
+
 def update_user_profile(user_id, update_data):
     """Update user profile with the provided data"""
-    return db.users.update_one(
+    result = db.users.update_one(
         {"user_id": user_id},
         {"$set": update_data}
     )
+    invalidate_user_cache(user_id)
+    return result
 
 # Roadmap and learning plan functions
+# road_map is stored as a native subdocument so single fields can be updated
+# in place; older accounts may still hold it as a JSON string.
+def load_roadmap(user):
+    """Get the roadmap dict from a user document (handles legacy JSON strings)"""
+    road_map = (user or {}).get("road_map") or {}
+    if isinstance(road_map, str):
+        try:
+            return json.loads(road_map)
+        except ValueError:
+            return {}
+    return road_map
+
+def ensure_roadmap_document(user):
+    """Convert a user's legacy JSON-string road_map to a subdocument so dot-path updates work"""
+    if user and isinstance(user.get("road_map"), str):
+        db.users.update_one(
+            {"user_id": user["user_id"], "road_map": {"$type": "string"}},
+            {"$set": {"road_map": load_roadmap(user)}}
+        )
+        invalidate_user_cache(user["user_id"])
+
+def migrate_roadmaps():
+    """One-off migration of every legacy JSON-string road_map; returns the number converted"""
+    migrated = 0
+    for user in db.users.find({"road_map": {"$type": "string"}}, {"user_id": 1, "road_map": 1}):
+        ensure_roadmap_document(user)
+        migrated += 1
+    return migrated
+
+# Roadmap (re)generation state lives on the user document as road_map_status
+# ({state, job_id, phases_ready, updated_at}) so every worker sees the same job.
+# A pending job that hasn't reported progress for this long is treated as dead.
+ROADMAP_JOB_TIMEOUT = 300
+
+def get_roadmap_status(user_id):
+    """
+    Current roadmap generation state, read straight from MongoDB.
+
+    Returns:
+        tuple: (state, phases_ready) with state one of pending, failed, ready, missing
+    """
+    doc = db.users.find_one(
+        {"user_id": user_id},
+        {"_id": 0, "road_map_status": 1, "road_map.phases": {"$slice": 1}}
+    ) or {}
+    status = doc.get("road_map_status") or {}
+    state = status.get("state")
+    if state == "pending":
+        updated_at = status.get("updated_at")
+        if updated_at and (datetime.datetime.utcnow() - updated_at).total_seconds() > ROADMAP_JOB_TIMEOUT:
+            state = "failed"
+    if state in ("pending", "failed"):
+        return state, status.get("phases_ready", 0)
+    return ("ready" if doc.get("road_map") else "missing"), 0
+
 def get_user_roadmap(user_id):
     """Get user's roadmap data"""
-    user = get_user_by_id(user_id)
+    user = get_user_with_roadmap(user_id)
     if user and "road_map" in user:
-        return user["road_map"]
+        return load_roadmap(user)
     return None
 
+def get_roadmap_phase(user_id, phase_idx):
+    """
+    Get a single phase of a user's roadmap, or None if the user or phase doesn't exist.
+    MongoDB returns just that phase.
+    """
+    if phase_idx < 0:
+        return None
+
+    doc = db.users.find_one(
+        {"user_id": user_id},
+        {"_id": 0, "user_id": 1, "road_map.phases": {"$slice": [phase_idx, 1]}}
+    )
+    if doc is None:
+        return None
+    road_map = doc.get("road_map")
+    if isinstance(road_map, dict):
+        phases = road_map.get("phases") or []
+        return phases[0] if phases else None
+
+    # Legacy JSON-string roadmap: can't be sliced server-side
+    user = get_user_with_roadmap(user_id)
+    phases = load_roadmap(user).get("phases") or []
+    return phases[phase_idx] if phase_idx < len(phases) else None
+
 def update_learning_plan(user_id, phase_id, learning_plan):
     """Update or add a learning plan for a specific phase"""
-    return db.users.update_one(
+    result = db.users.update_one(
         {
             "user_id": user_id,
             "active_modules.phase_id": phase_id
@@ -77,20 +278,24 @@ def update_learning_plan(user_id, phase_id, learning_plan):
             }
         }
     )
+    invalidate_user_cache(user_id)
+    return result
 
 def add_module_to_user(user_id, module_data):
     """Add a new module to user's active modules"""
-    return db.users.update_one(
+    result = db.users.update_one(
         {"user_id": user_id},
         {"$addToSet": {"active_modules": module_data}}
     )
+    invalidate_user_cache(user_id)
+    return result
 
 def update_task_completion(user_id, phase_id, week_num, day_num, completed, completion_date=None):
     """Update task completion status"""
     if completion_date is None:
         completion_date = datetime.datetime.now() if completed else None
         
-    return db.users.update_one(
+    result = db.users.update_one(
         {
             "user_id": user_id,
             "active_modules.phase_id": phase_id,
@@ -106,12 +311,20 @@ def update_task_completion(user_id, phase_id, week_num, day_num, completed, comp
             {"day.day": int(day_num)}
         ]
     )
+    invalidate_user_cache(user_id)
+    return result
 
 # Notification functions
 def add_notification(notification_data):
     """Add a new notification"""
     return db.notifications.insert_one(notification_data)
 
+def add_notifications_bulk(notifications):
+    """Add several notifications in a single round trip"""
+    if not notifications:
+        return None
+    return db.notifications.insert_many(notifications, ordered=False)
+
 def get_user_notifications(user_id, limit=5, unread_only=True):
     """Get notifications for a user"""
     query = {"user_id": user_id}
@@ -125,4 +338,13 @@ def mark_notification_read(notification_id):
     return db.notifications.update_one(
         {"_id": ObjectId(notification_id)},
         {"$set": {"read": True}}
-    )
\ No newline at end of file
+    )
+
+def mark_notifications_read_bulk(notification_ids, user_id=None):
+    """Mark several notifications as read with one update (optionally scoped to a user)"""
+    if not notification_ids:
+        return None
+    query = {"_id": {"$in": [ObjectId(n) for n in notification_ids]}}
+    if user_id is not None:
+        query["user_id"] = user_id
+    return db.notifications.update_many(query, {"$set": {"read": True}})
\ No newline at end of file
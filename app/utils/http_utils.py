@@ -0,0 +1,131 @@
+import time
+import threading
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Default (connect, read) timeout for outbound API calls
+DEFAULT_TIMEOUT = (2, 5)
+
+# Longest Retry-After we'll sleep for inside a user-facing request; a server
+# asking for more gets the failure back instead of stalling the worker
+RETRY_AFTER_MAX = 5
+
+class _CappedRetry(Retry):
+    """Retry that honors Retry-After, but never for longer than RETRY_AFTER_MAX"""
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        return None if retry_after is None else min(retry_after, RETRY_AFTER_MAX)
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of calling a dependency whose circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker. After `fail_max` failures in a row the
+    circuit opens and calls fail fast for `reset_timeout` seconds; then a single
+    probe is let through, which closes the circuit on success or reopens it.
+    """
+
+    def __init__(self, name, fail_max=5, reset_timeout=30):
+        self.name = name
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raise CircuitOpenError if calls should fail fast right now"""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if self._probing or time.monotonic() - self._opened_at < self.reset_timeout:
+                raise CircuitOpenError(f"Circuit open for {self.name}")
+            # Half-open: this caller is the probe
+            self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.fail_max:
+                if self._opened_at is None or self._probing:
+                    print(f"[HTTP] Circuit opened for {self.name}")
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+# Responses that mean the upstream is struggling (after retries were spent)
+BREAKER_FAILURE_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+class _BreakerAdapter(HTTPAdapter):
+    """
+    HTTPAdapter with a circuit breaker per host, so a dead API fails fast, and
+    DEFAULT_TIMEOUT for any request sent without its own timeout
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._breakers = {}
+        self._breakers_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def _breaker(self, url):
+        host = urlsplit(url).hostname or ""
+        with self._breakers_lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = self._breakers[host] = CircuitBreaker(host)
+            return breaker
+
+    def send(self, request, **kwargs):
+        # Safety net: a call that forgot its timeout must not hang a worker
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = DEFAULT_TIMEOUT
+        breaker = self._breaker(request.url)
+        breaker.before_call()
+        try:
+            response = super().send(request, **kwargs)
+        except Exception:
+            breaker.record_failure()
+            raise
+        if response.status_code in BREAKER_FAILURE_STATUSES:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
+
+def _build_session():
+    """Keep-alive session that retries idempotent requests on rate limits and gateway errors"""
+    session = requests.Session()
+    # GitHub rejects requests without a User-Agent; send one on every call.
+    # Google APIs only gzip responses when the User-Agent mentions gzip
+    # (requests already sends Accept-Encoding: gzip, deflate)
+    session.headers.update({"User-Agent": "CatalystAI-CareerCoach (gzip)"})
+    retry = _CappedRetry(
+        total=2,
+        backoff_factor=0.2,
+        # Spread retries out so clients that failed together don't retry together
+        backoff_jitter=0.1,
+        status_forcelist=[429, 502, 503, 504],
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        respect_retry_after_header=True,
+        # Once retries run out, hand back the last response so callers can check its status
+        raise_on_status=False,
+    )
+    adapter = _BreakerAdapter(pool_connections=20, pool_maxsize=50, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+# One connection pool shared by every outbound HTTP call in the process
+SESSION = _build_session()
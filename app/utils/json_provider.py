@@ -0,0 +1,23 @@
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional speed-up; Flask's stdlib provider is used without it
+    orjson = None
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider backed by orjson (used by jsonify, request.json and
+    the session cookie serializer).
+    """
+
+    def dumps(self, obj, **kwargs):
+        # Let Flask's default() keep formatting datetimes as HTTP dates
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if kwargs.get("sort_keys", self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
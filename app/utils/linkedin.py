@@ -1,20 +1,35 @@
 import os
+import re
 import time
-import requests
 import json
 from datetime import datetime
+from functools import lru_cache
 from urllib.parse import urlparse
-from app.utils.db_utils import get_db
+from app.utils.db_utils import get_db, invalidate_user_cache
+from app.utils.http_utils import SESSION
 
 # Configuration
 API_ENDPOINT = "https://gw.magicalapi.com/profile-data"
 CACHE_HOURS = 24
+LINKEDIN_TIMEOUT = (3, 15)  # (connect, read) seconds per API call
+POLL_INITIAL_DELAY = 1.0
+POLL_MAX_DELAY = 4.0
+POLL_TIMEOUT = 30
 
+# Fast path for the usual https://www.linkedin.com/in/<username>/ form
+_LINKEDIN_PROFILE_RE = re.compile(r"linkedin\.com/in/([^/?#]+)", re.IGNORECASE)
+
+@lru_cache(maxsize=4096)
 def extract_username(url):
     """
     Extracts the username from a LinkedIn URL.
     e.g. https://www.linkedin.com/in/williamhgates/ -> williamhgates
     """
+    match = _LINKEDIN_PROFILE_RE.search(url or "")
+    if match:
+        return match.group(1)
+
+    # Unusual URLs: fall back to parsing the path
     try:
         parsed = urlparse(url)
         path_parts = [p for p in parsed.path.split('/') if p]
@@ -46,7 +61,8 @@ def fetch_linkedin_profile_brightdata(linkedin_url: str, user_id: str, force_ref
     coll = db.linkedin_data
 
     # === 1. Check Cache ===
-    cached = coll.find_one({"user_id": user_id})
+    # Only indexed fields, so the freshness check is answered from the index alone
+    cached = coll.find_one({"user_id": user_id}, {"_id": 0, "user_id": 1, "last_updated": 1})
     if cached and not force_refresh:
         last_updated = cached.get("last_updated")
         if last_updated:
@@ -79,7 +95,7 @@ def fetch_linkedin_profile_brightdata(linkedin_url: str, user_id: str, force_ref
         
         # === 3. Send Initial Request ===
         init_payload = {"profile_name": username}
-        response = requests.post(API_ENDPOINT, json=init_payload, headers=headers)
+        response = SESSION.post(API_ENDPOINT, json=init_payload, headers=headers, timeout=LINKEDIN_TIMEOUT)
         resp_json = response.json()
 
         request_id = resp_json.get("data", {}).get("request_id")
@@ -96,12 +112,16 @@ def fetch_linkedin_profile_brightdata(linkedin_url: str, user_id: str, force_ref
             print(f"[LinkedIn] Polling for Request ID: {request_id}")
             raw_data = None
             
-            # Poll up to 10 times (approx 30 seconds)
-            for i in range(10):
-                time.sleep(3) # Wait 3s between checks
+            # Poll with exponential backoff (1s, 1.5s, 2.25s, ... capped at 4s)
+            # so fast scrapes are picked up early, giving up after ~30 seconds
+            delay = POLL_INITIAL_DELAY
+            deadline = time.monotonic() + POLL_TIMEOUT
+            while time.monotonic() + delay < deadline:
+                time.sleep(delay)
+                delay = min(delay * 1.5, POLL_MAX_DELAY)
                 
                 poll_payload = {"request_id": request_id}
-                poll_resp = requests.post(API_ENDPOINT, json=poll_payload, headers=headers)
+                poll_resp = SESSION.post(API_ENDPOINT, json=poll_payload, headers=headers, timeout=LINKEDIN_TIMEOUT)
                 poll_json = poll_resp.json()
                 
                 data_obj = poll_json.get("data", {})
@@ -176,6 +196,7 @@ def fetch_linkedin_profile_brightdata(linkedin_url: str, user_id: str, force_ref
 
         # === 6. Save to DB ===
         coll.update_one({"user_id": user_id}, {"$set": profile_data}, upsert=True)
+        invalidate_user_cache(user_id)
         print(f"[LinkedIn] SUCCESS: Saved {profile_data['name']} to DB")
         
         return {"status": "success", "message": "Fetched & cached"}
@@ -1,32 +1,191 @@
 import os
+import re
 import json
-import requests
+import hashlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from copy import deepcopy
+from datetime import datetime
+from functools import lru_cache
+from cachetools import LRUCache, TTLCache
 from mistralai import Mistral
-from groq import Groq
-from markdown2 import Markdown
+from groq import Groq, APIConnectionError, InternalServerError, RateLimitError
 from dotenv import load_dotenv
+from app.utils.http_utils import SESSION, DEFAULT_TIMEOUT, CircuitBreaker
+
+# Model output is parsed on every roadmap/plan request; orjson is much faster when available
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    _json_loads = orjson.loads
+
+    def _json_dumps_sorted(obj):
+        """Compact, key-sorted JSON (cache keys and other hashed payloads)"""
+        return orjson.dumps(obj, default=str, option=orjson.OPT_SORT_KEYS).decode("utf-8")
+else:
+    _json_loads = json.loads
+
+    def _json_dumps_sorted(obj):
+        """Compact, key-sorted JSON (cache keys and other hashed payloads)"""
+        return json.dumps(obj, default=str, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
 
 # Load environment variables
 load_dotenv()
 
-markdowner = Markdown()
-
 # === MISTRAL API ===
 MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
 if not MISTRAL_API_KEY:
     raise ValueError("MISTRAL_API_KEY not found in .env")
 
-mistral_client = Mistral(api_key=MISTRAL_API_KEY)
+# Bounded like the Groq client below, so a stalled call can't pin a worker indefinitely
+mistral_client = Mistral(
+    api_key=MISTRAL_API_KEY,
+    timeout_ms=int(float(os.getenv("MISTRAL_TIMEOUT", "30")) * 1000)
+)
 
 # === GROQ API ===
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 if not GROQ_API_KEY:
     print("WARNING: GROQ_API_KEY not found. Groq functions will fail.")
 else:
-    groq_client = Groq(api_key=GROQ_API_KEY)
+    # The SDK retries connection errors, 429s and 5xx with jittered exponential
+    # backoff (honoring Retry-After); GROQ_MAX_RETRIES bounds how long that can take
+    groq_client = Groq(
+        api_key=GROQ_API_KEY,
+        timeout=float(os.getenv("GROQ_TIMEOUT", "30")),
+        max_retries=int(os.getenv("GROQ_MAX_RETRIES", "2"))
+    )
 
 GROQ_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"
 
+# Caps in-flight Groq requests per process so bursts queue here instead of
+# tripping the provider's rate limit
+GROQ_MAX_CONCURRENCY = int(os.getenv("GROQ_MAX_CONCURRENCY", "8"))
+GROQ_SLOT_WAIT = 30
+_groq_slots = threading.BoundedSemaphore(GROQ_MAX_CONCURRENCY)
+
+def _acquire_groq_slot():
+    """Wait for a free Groq request slot (raises TimeoutError if none frees up)"""
+    if not _groq_slots.acquire(timeout=GROQ_SLOT_WAIT):
+        raise TimeoutError("Timed out waiting for a free Groq request slot")
+
+# Once Groq keeps failing, callers go straight to their fallbacks instead of
+# each waiting out the timeout and retries
+_groq_breaker = CircuitBreaker("Groq")
+
+def _groq_create(**kwargs):
+    """chat.completions.create behind the Groq circuit breaker"""
+    _groq_breaker.before_call()
+    try:
+        result = groq_client.chat.completions.create(**kwargs)
+    except (APIConnectionError, InternalServerError, RateLimitError):
+        # Only outages/overload trip the breaker; bad requests are the caller's problem
+        _groq_breaker.record_failure()
+        raise
+    except Exception:
+        _groq_breaker.record_success()
+        raise
+    _groq_breaker.record_success()
+    return result
+
+def groq_completion(**kwargs):
+    """Groq chat completion, limited to GROQ_MAX_CONCURRENCY concurrent calls"""
+    _acquire_groq_slot()
+    try:
+        return _groq_create(**kwargs)
+    finally:
+        _groq_slots.release()
+
+# === PROMPTS ===
+# Static text lives here so it isn't rebuilt per call, and system prompts stay
+# byte-identical across requests (the shared prefix is what provider-side
+# prompt caching can reuse)
+JSON_SYSTEM_PROMPT = "You are a JSON expert. Return ONLY valid JSON. No code blocks. No extra text."
+
+ROADMAP_PROMPT = '''Create a structured learning roadmap for "{topic}" in this EXACT JSON format:
+{{
+    "phases": [
+        {{
+            "name": "Phase Name",
+            "duration": "X-Y months",
+            "description": "Brief description of phase",
+            "skills": ["skill1", "skill2"],
+            "resources": {{
+                "Courses": ["Course name"],
+                "Books": ["Book title"],
+                "Projects": ["Project idea"]
+            }}
+        }}
+    ]
+}}
+{duration_context}
+Include exactly 4 phases. Return ONLY valid JSON. No markdown, no explanations.'''
+
+LEARNING_PLAN_PROMPT = '''Generate a detailed 4-week learning plan for the phase "{phase_name}" 
+    focusing on skills: {skills}.
+
+    Return ONLY valid JSON in this EXACT format:
+    {{
+        "weekly_schedule": [
+            {{
+                "week": 1,
+                "learning_objectives": ["Objective 1", "Objective 2"],
+                "daily_tasks": [
+                    {{
+                        "day": 1,
+                        "tasks": ["Task 1", "Task 2"],
+                        "resources": ["Resource 1"],
+                        "duration_hours": 2
+                    }}
+                ],
+                "assessment": "Short quiz or project"
+            }}
+        ]
+    }}
+
+    Include exactly 4 weeks. Return ONLY JSON. No markdown. No explanations.'''
+
+LEARNING_PLAN_BATCH_PROMPT = '''Generate a detailed 4-week learning plan for EACH of the phases below.
+
+    {sections}
+
+    Return ONLY valid JSON keyed by the phase number in brackets, in this EXACT format:
+    {{
+        "1": {{
+            "weekly_schedule": [
+                {{
+                    "week": 1,
+                    "learning_objectives": ["Objective 1", "Objective 2"],
+                    "daily_tasks": [
+                        {{
+                            "day": 1,
+                            "tasks": ["Task 1", "Task 2"],
+                            "resources": ["Resource 1"],
+                            "duration_hours": 2
+                        }}
+                    ],
+                    "assessment": "Short quiz or project"
+                }}
+            ]
+        }}
+    }}
+
+    Include exactly 4 weeks per phase. Return ONLY JSON. No markdown. No explanations.'''
+
+TUTOR_SYSTEM_PROMPT = "You are an AI tutor. Be concise, educational, and encouraging.\n"
+TUTOR_MODULE_CONTEXT = """Topic: {topic}
+Objectives: {objectives}
+Skills: {skills}
+Resources:
+{resources}"""
+
+
+# Per-phase learning plan calls run here so they overlap instead of queuing
+_plan_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="learning-plan")
+
 
 # ===================================================================
 # MISTRAL: CAREER COACH (LEO)
@@ -56,6 +215,37 @@ def get_mistral_response(prompt, tokens=300):
         return "Hi there! With your skills, next: build a small project this week. I’ll help you plan it!"
 
 
+def get_mistral_response_stream(prompt, tokens=300):
+    """
+    Streaming variant of get_mistral_response: yields text deltas as Mistral
+    produces them. A failure after the first delta ends the stream quietly, so the
+    canned fallback is never glued onto a partial reply.
+    """
+    sent = False
+    try:
+        stream = mistral_client.chat.stream(
+            model="open-mistral-nemo",
+            messages=[
+                {
+                    "role": "system",
+                    "content": "You are Leo, a friendly career coach. Be concise, warm, and give 1 actionable tip."
+                },
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=tokens,
+            temperature=0.7
+        )
+        for event in stream:
+            delta = event.data.choices[0].delta.content
+            if delta:
+                sent = True
+                yield delta
+    except Exception as e:
+        print(f"[Mistral] Stream error: {e}")
+        if not sent:
+            yield "Hi there! With your skills, next: build a small project this week. I’ll help you plan it!"
+
+
 def generate_prompt(user_data, user_query, chat_history):
     """
     Safe prompt with PII — Mistral doesn't care
@@ -104,6 +294,8 @@ Respond:
 # GITHUB
 # ===================================================================
 
+_GITHUB_PROFILE_RE = re.compile(r"github\.com/([^/?#\s]*)", re.IGNORECASE)
+
 def extract_github_username(github_input):
     """
     Extract GitHub username from a profile URL or return as-is if already a username.
@@ -119,19 +311,62 @@ def extract_github_username(github_input):
     
     github_input = github_input.strip().rstrip('/')
     
-    # Check if it's a URL
-    if 'github.com' in github_input:
-        # Extract the username from the URL path
-        parts = github_input.split('github.com/')
-        if len(parts) > 1:
-            # Get the first path segment (username)
-            username = parts[1].split('/')[0]
-            return username if username else None
+    # URL: the first path segment after github.com is the username
+    match = _GITHUB_PROFILE_RE.search(github_input)
+    if match:
+        return match.group(1) or None
     
     # Already a username
     return github_input
 
 
+class _SingleFlight:
+    """
+    Collapse concurrent calls that share a key into one execution: the first
+    caller runs it, everyone arriving meanwhile waits for and shares its result.
+    Pairs with the caches above it, which the first caller fills for later ones.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+
+        if not leader:
+            # Callers may mutate what they get back, so followers get their own copy
+            return deepcopy(future.result())
+
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            # Followers copy from a snapshot the leader's caller can't mutate
+            future.set_result(deepcopy(result))
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+# In-flight Groq/GitHub requests, keyed like their cache entries
+_inflight = _SingleFlight()
+
+# Per-username repo lists; GitHub data changes slowly, so an hour is plenty
+_github_cache = TTLCache(maxsize=1024, ttl=3600)
+# (ETag, projects) kept past the TTL so a stale entry can be revalidated with
+# If-None-Match; GitHub answers 304 with no body and no rate-limit cost
+_github_etags = LRUCache(maxsize=1024)
+_github_cache_lock = threading.Lock()
+
+
 def fetch_github_projects(github_input):
     """
     Fetch GitHub repositories for a user.
@@ -148,14 +383,33 @@ def fetch_github_projects(github_input):
     if not username:
         return "No valid GitHub username provided"
     
+    cache_key = username.lower()
+    with _github_cache_lock:
+        cached = _github_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    return _inflight.do(f"github:{cache_key}", _fetch_github_projects, username, cache_key)
+
+
+def _fetch_github_projects(username, cache_key):
+    """GitHub request behind fetch_github_projects (cache miss path)"""
+    with _github_cache_lock:
+        etag, stale = _github_etags.get(cache_key, (None, None))
+
     url = f"https://api.github.com/users/{username}/repos?sort=updated&per_page=10"
     try:
-        response = requests.get(url, headers={"User-Agent": "CatalystAI-CareerCoach"})
+        headers = {"If-None-Match": etag} if etag else None
+        response = SESSION.get(url, headers=headers, timeout=DEFAULT_TIMEOUT)
+        if response.status_code == 304 and stale is not None:
+            with _github_cache_lock:
+                _github_cache[cache_key] = stale
+            return stale
         response.raise_for_status()
         repos = response.json()
         
         # Return richer data
-        return [
+        projects = [
             {
                 "title": r["name"],
                 "description": r["description"] or "No description",
@@ -164,37 +418,96 @@ def fetch_github_projects(github_input):
             }
             for r in repos
         ]
+        # Only successful fetches are cached; errors are retried next time
+        with _github_cache_lock:
+            _github_cache[cache_key] = projects
+            if response.headers.get("ETag"):
+                _github_etags[cache_key] = (response.headers["ETag"], projects)
+        return projects
     except Exception as e:
         print(f"[GitHub] Fetch failed for '{username}': {e}")
         return f"GitHub fetch failed: {e}"
 
 
+# ===================================================================
+# LLM RESULT CACHE
+# ===================================================================
+# Roadmaps and learning plans depend only on their (normalized) inputs and are
+# shared across users. Hot entries live in-process; all entries are persisted
+# in the `llm_cache` collection (expired by a TTL index on created_at).
+
+_llm_memory_cache = TTLCache(maxsize=1024, ttl=3600)
+_llm_cache_lock = threading.Lock()
+
+
+def _llm_cache_key(kind, **params):
+    """Stable hash of the model, request kind and normalized inputs"""
+    payload = _json_dumps_sorted({"kind": kind, "model": GROQ_MODEL, **params})
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _llm_cache_get(key):
+    """Look up a cached LLM result; returns a private copy or None"""
+    with _llm_cache_lock:
+        hit = _llm_memory_cache.get(key)
+    if hit is not None:
+        return deepcopy(hit)
+
+    from app.utils.db_utils import get_db
+    try:
+        doc = get_db().llm_cache.find_one({"_id": key}, {"result": 1})
+    except Exception as e:
+        print(f"[LLM Cache] Read failed: {e}")
+        return None
+    if not doc:
+        return None
+
+    with _llm_cache_lock:
+        _llm_memory_cache[key] = doc["result"]
+    return deepcopy(doc["result"])
+
+
+def _llm_cache_set(key, result):
+    """Store an LLM result in both cache tiers"""
+    with _llm_cache_lock:
+        _llm_memory_cache[key] = deepcopy(result)
+
+    from app.utils.db_utils import get_db
+    try:
+        get_db().llm_cache.update_one(
+            {"_id": key},
+            {"$set": {"result": result, "created_at": datetime.utcnow()}},
+            upsert=True
+        )
+    except Exception as e:
+        print(f"[LLM Cache] Write failed: {e}")
+
+
 # ===================================================================
 # GROQ: LEARNING PLANS & TUTOR (FULLY WORKING)
 # ===================================================================
 
-def get_roadmap_from_groq(topic, duration=None, duration_unit="months"):
-    """
-    Generate a 4-phase learning roadmap using Groq.
-    Optionally accepts a duration to customize phase timelines.
-    Returns valid JSON with 'resources' in every phase — NO TEMPLATE CRASHES.
-    """
-    if not GROQ_API_KEY:
-        return {
-            "phases": [
-                {
-                    "name": "Setup Required",
-                    "duration": "N/A",
-                    "description": "GROQ_API_KEY is missing in .env",
-                    "skills": ["Fix environment"],
-                    "resources": {
-                        "Documentation": ["Add GROQ_API_KEY to .env"],
-                        "Support": ["https://console.groq.com"]
-                    }
-                }
-            ] * 4
-        }
+# Optional ```/```json fence around a model's JSON reply
+_CODE_FENCE_RE = re.compile(r"^\s*```[\w-]*[ \t]*\n?(.*?)\n?[ \t]*(?:```)?\s*$", re.DOTALL)
+
+def _strip_code_fence(content):
+    """Return the model's reply without surrounding whitespace or a markdown code fence"""
+    match = _CODE_FENCE_RE.match(content)
+    return match.group(1).strip() if match else content.strip()
 
+
+def _roadmap_cache_key(topic, duration, duration_unit):
+    """Cache key shared by the blocking and streaming roadmap generators"""
+    return _llm_cache_key(
+        "roadmap",
+        topic=str(topic).strip().lower(),
+        duration=str(duration).strip() if duration else None,
+        duration_unit=duration_unit if duration else None,
+    )
+
+
+def _roadmap_messages(topic, duration, duration_unit):
+    """System and user messages for a 4-phase roadmap request"""
     # Build duration context for the prompt
     duration_context = ""
     if duration:
@@ -203,89 +516,300 @@ def get_roadmap_from_groq(topic, duration=None, duration_unit="months"):
     else:
         duration_context = "\nAssume a standard 6-12 month learning timeline."
 
-    prompt = f'''Create a structured learning roadmap for "{topic}" in this EXACT JSON format:
-{{
-    "phases": [
-        {{
-            "name": "Phase Name",
-            "duration": "X-Y months",
-            "description": "Brief description of phase",
-            "skills": ["skill1", "skill2"],
-            "resources": {{
-                "Courses": ["Course name"],
-                "Books": ["Book title"],
-                "Projects": ["Project idea"]
-            }}
-        }}
+    prompt = ROADMAP_PROMPT.format(topic=topic, duration_context=duration_context)
+
+    return [
+        {"role": "system", "content": JSON_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
     ]
-}}
-{duration_context}
-Include exactly 4 phases. Return ONLY valid JSON. No markdown, no explanations.'''
 
+
+_REQUIRED_PHASE_KEYS = frozenset(("name", "duration", "description", "skills", "resources"))
+_REQUIRED_RESOURCE_KEYS = frozenset(("Courses", "Books", "Projects"))
+
+def _normalize_roadmap_phase(phase, i, topic):
+    """Fill in any keys the model left out of a roadmap phase"""
+    # Fast path: a complete phase needs no defaults built at all
+    res = phase.get("resources")
+    if _REQUIRED_PHASE_KEYS <= phase.keys() and isinstance(res, dict) and _REQUIRED_RESOURCE_KEYS <= res.keys():
+        return phase
+
+    if "name" not in phase:
+        phase["name"] = f"Phase {i+1}: {topic} Learning"
+    phase.setdefault("duration", "1-2 months")
+    if "description" not in phase:
+        phase["description"] = f"Focus on core concepts of {topic}"
+    if "skills" not in phase:
+        phase["skills"] = [f"Skill {i+1}"]
+
+    # === GUARANTEE 'resources' EXISTS ===
+    if not isinstance(res, dict):
+        res = phase["resources"] = {}
+
+    if "Courses" not in res:
+        res["Courses"] = [f"Search '{topic}' on Coursera/Udemy"]
+    if "Books" not in res:
+        res["Books"] = ["Beginner guide"]
+    if "Projects" not in res:
+        res["Projects"] = ["Build a small project"]
+    return phase
+
+
+def _pad_roadmap_phases(phases):
+    """Trim to 4 phases, repeating the last one as an extension if the model returned fewer"""
+    phases = phases[:4]
+    last = phases[-1] if phases else None
+    while len(phases) < 4 and last:
+        # Deep copy so the padded phases don't share lists/dicts with the original
+        extended = deepcopy(last)
+        extended["name"] = f"{last['name']} (Extended)"
+        phases.append(extended)
+    return phases
+
+
+def _fallback_roadmap(topic):
+    """Generic 4-phase roadmap used when Groq fails"""
+    # === BULLETPROOF FALLBACK ===
+    fallback_phase = {
+        "name": f"{topic} Basics",
+        "duration": "1-2 months",
+        "description": f"Learn the fundamentals of {topic}",
+        "skills": ["Core concepts", "Basic tools"],
+        "resources": {
+            "Courses": ["YouTube tutorials", "Official docs"],
+            "Books": ["Beginner guide"],
+            "Projects": ["Hello World project"]
+        }
+    }
+    # Separate copies: a list of one dict repeated would alias every phase
+    return {"phases": [deepcopy(fallback_phase) for _ in range(4)]}
+
+
+def _missing_key_roadmap():
+    """Placeholder roadmap shown when GROQ_API_KEY is not configured"""
+    return {
+        "phases": [
+            {
+                "name": "Setup Required",
+                "duration": "N/A",
+                "description": "GROQ_API_KEY is missing in .env",
+                "skills": ["Fix environment"],
+                "resources": {
+                    "Documentation": ["Add GROQ_API_KEY to .env"],
+                    "Support": ["https://console.groq.com"]
+                }
+            }
+            for _ in range(4)
+        ]
+    }
+
+
+def get_roadmap_from_groq(topic, duration=None, duration_unit="months"):
+    """
+    Generate a 4-phase learning roadmap using Groq.
+    Optionally accepts a duration to customize phase timelines.
+    Returns valid JSON with 'resources' in every phase — NO TEMPLATE CRASHES.
+    """
+    if not GROQ_API_KEY:
+        return _missing_key_roadmap()
+
+    cache_key = _roadmap_cache_key(topic, duration, duration_unit)
+    cached = _llm_cache_get(cache_key)
+    if cached is not None:
+        return cached
+
+    return _inflight.do(cache_key, _generate_roadmap, cache_key, topic, duration, duration_unit)
+
+
+def _generate_roadmap(cache_key, topic, duration, duration_unit):
+    """Groq call behind get_roadmap_from_groq (cache miss path)"""
     try:
-        response = groq_client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": "You are a JSON expert. Return ONLY valid JSON. No ```json blocks. No extra text."},
-                {"role": "user", "content": prompt}
-            ],
+        response = groq_completion(
+            messages=_roadmap_messages(topic, duration, duration_unit),
             model=GROQ_MODEL,
             temperature=0.1,
             max_tokens=2000
         )
 
-        content = response.choices[0].message.content.strip()
-
         # Remove code blocks if present
-        if content.startswith("```"):
-            lines = content.splitlines()
-            content = "\n".join(lines[1:-1] if lines[-1].strip().startswith("```") else lines[1:]).strip()
+        content = _strip_code_fence(response.choices[0].message.content)
 
-        roadmap = json.loads(content)
+        roadmap = _json_loads(content)
 
         # === VALIDATE & ENFORCE STRUCTURE ===
         if not isinstance(roadmap.get("phases"), list) or len(roadmap["phases"]) == 0:
             raise ValueError("No phases in response")
 
-        # Ensure exactly 4 phases
-        phases = roadmap["phases"][:4]
-        if len(phases) < 4:
-            last = phases[-1] if phases else None
-            while len(phases) < 4 and last:
-                phases.append({**last, "name": f"{last['name']} (Extended)"})
-        
-        # Fix each phase
+        # Ensure exactly 4 phases, then fix each one
+        phases = _pad_roadmap_phases(roadmap["phases"])
         for i, phase in enumerate(phases):
-            phase.setdefault("name", f"Phase {i+1}: {topic} Learning")
-            phase.setdefault("duration", "1-2 months")
-            phase.setdefault("description", f"Focus on core concepts of {topic}")
-            phase.setdefault("skills", [f"Skill {i+1}"])
+            _normalize_roadmap_phase(phase, i, topic)
 
-            # === GUARANTEE 'resources' EXISTS ===
-            if not isinstance(phase.get("resources"), dict):
-                phase["resources"] = {}
+        roadmap = {"phases": phases}
+        _llm_cache_set(cache_key, roadmap)
+        return roadmap
 
-            res = phase["resources"]
-            res.setdefault("Courses", [f"Search '{topic}' on Coursera/Udemy"])
-            res.setdefault("Books", ["Beginner guide"])
-            res.setdefault("Projects", ["Build a small project"])
+    except Exception as e:
+        print(f"[Groq] Roadmap generation failed: {e}")
+        return _fallback_roadmap(topic)
+
+
+def _iter_array_objects(chunks, key):
+    """
+    Incrementally scan streamed JSON text and yield each object in the array
+    under `key` as soon as its closing brace arrives. Anything outside that
+    array (code fences, other keys) is skipped.
+    """
+    marker = f'"{key}"'
+    buf = ""
+    pos = 0
+    in_array = False
+    depth = 0
+    start = None
+    in_string = False
+    escaped = False
+
+    for chunk in chunks:
+        buf += chunk
+        if not in_array:
+            found = buf.find(marker)
+            if found == -1:
+                continue
+            bracket = buf.find("[", found + len(marker))
+            if bracket == -1:
+                continue
+            in_array = True
+            pos = bracket + 1
+
+        while pos < len(buf):
+            ch = buf[pos]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == "\\":
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch == "{":
+                if depth == 0:
+                    start = pos
+                depth += 1
+            elif ch == "}":
+                depth -= 1
+                if depth == 0:
+                    yield _json_loads(buf[start:pos + 1])
+                    # Drop the consumed text so the buffer stays small
+                    buf = buf[pos + 1:]
+                    pos = -1
+            elif ch == "]" and depth == 0:
+                return
+            pos += 1
+
+
+def stream_roadmap_from_groq(topic, duration=None, duration_unit="months"):
+    """
+    Streaming variant of get_roadmap_from_groq: yields each of the 4 phases as
+    soon as the model finishes writing it. Phases are normalized the same way,
+    the complete roadmap is cached, and failures fall back to the same defaults
+    (only the phases not yet yielded are filled in).
+    """
+    if not GROQ_API_KEY:
+        yield from _missing_key_roadmap()["phases"]
+        return
 
-        return {"phases": phases}
+    cache_key = _roadmap_cache_key(topic, duration, duration_unit)
+    cached = _llm_cache_get(cache_key)
+    if cached is not None:
+        yield from cached["phases"]
+        return
 
+    phases = []
+    try:
+        _acquire_groq_slot()
+        try:
+            stream = _groq_create(
+                messages=_roadmap_messages(topic, duration, duration_unit),
+                model=GROQ_MODEL,
+                temperature=0.1,
+                max_tokens=2000,
+                stream=True
+            )
+            deltas = (chunk.choices[0].delta.content or "" for chunk in stream if chunk.choices)
+            for phase in _iter_array_objects(deltas, "phases"):
+                if not isinstance(phase, dict):
+                    continue
+                phase = _normalize_roadmap_phase(phase, len(phases), topic)
+                phases.append(phase)
+                yield phase
+                if len(phases) == 4:
+                    break
+        finally:
+            _groq_slots.release()
     except Exception as e:
-        print(f"[Groq] Roadmap generation failed: {e}")
-        # === BULLETPROOF FALLBACK ===
-        fallback_phase = {
-            "name": f"{topic} Basics",
-            "duration": "1-2 months",
-            "description": f"Learn the fundamentals of {topic}",
-            "skills": ["Core concepts", "Basic tools"],
-            "resources": {
-                "Courses": ["YouTube tutorials", "Official docs"],
-                "Books": ["Beginner guide"],
-                "Projects": ["Hello World project"]
-            }
-        }
-        return {"phases": [fallback_phase] * 4}
+        print(f"[Groq] Roadmap stream failed: {e}")
+
+    if not phases:
+        yield from _fallback_roadmap(topic)["phases"]
+        return
+
+    # Fewer than 4 phases: extend the last one, as the blocking version does
+    padded = _pad_roadmap_phases(phases)
+    yield from padded[len(phases):]
+    if len(phases) == 4:
+        _llm_cache_set(cache_key, {"phases": padded})
+
+
+_REQUIRED_WEEK_KEYS = frozenset(("week", "learning_objectives", "assessment", "daily_tasks"))
+
+def _normalize_learning_plan(plan, phase_name):
+    """
+    Validate a model-generated learning plan and enforce its structure.
+    Raises ValueError if the plan has no usable weekly_schedule.
+    """
+    # === VALIDATE & ENFORCE STRUCTURE ===
+    if not isinstance(plan, dict) or not isinstance(plan.get("weekly_schedule"), list):
+        raise ValueError("Missing weekly_schedule")
+
+    weeks = plan["weekly_schedule"][:4]
+    if len(weeks) == 0:
+        raise ValueError("No weeks generated")
+
+    # Ensure each week has required keys
+    for i, week in enumerate(weeks):
+        daily = week.get("daily_tasks")
+        # Fast path: complete weeks are left as they are
+        if _REQUIRED_WEEK_KEYS <= week.keys() and isinstance(daily, list) and 0 < len(daily) <= 5:
+            continue
+
+        week.setdefault("week", i + 1)
+        if "learning_objectives" not in week:
+            week["learning_objectives"] = [f"Learn core concepts of week {i+1}"]
+        week.setdefault("assessment", "Complete daily tasks")
+
+        # Fix daily_tasks
+        if not isinstance(daily, list) or len(daily) == 0:
+            daily = [{
+                "day": 1,
+                "tasks": [f"Study {phase_name} fundamentals"],
+                "resources": ["Online tutorial"],
+                "duration_hours": 2
+            }]
+        week["daily_tasks"] = daily[:5]  # Limit to 5 days
+
+    # Pad to 4 weeks if needed
+    while len(weeks) < 4:
+        last = weeks[-1]
+        weeks.append({
+            "week": len(weeks) + 1,
+            "learning_objectives": list(last["learning_objectives"]),
+            # Task dicts carry per-task 'completed' state, so each week needs its own
+            "daily_tasks": deepcopy(last["daily_tasks"]),
+            "assessment": last["assessment"]
+        })
+
+    return {"weekly_schedule": weeks}
 
 
 def generate_learning_plan(phase_name, skills):
@@ -312,36 +836,28 @@ def generate_learning_plan(phase_name, skills):
             ]
         }
 
-    skills_str = ', '.join(skills) if skills else 'core concepts'
-    
-    prompt = f'''Generate a detailed 4-week learning plan for the phase "{phase_name}" 
-    focusing on skills: {skills_str}.
+    cache_key = _llm_cache_key(
+        "learning_plan",
+        phase_name=str(phase_name).strip().lower(),
+        skills=sorted(str(s).strip().lower() for s in skills or []),
+    )
+    cached = _llm_cache_get(cache_key)
+    if cached is not None:
+        return cached
 
-    Return ONLY valid JSON in this EXACT format:
-    {{
-        "weekly_schedule": [
-            {{
-                "week": 1,
-                "learning_objectives": ["Objective 1", "Objective 2"],
-                "daily_tasks": [
-                    {{
-                        "day": 1,
-                        "tasks": ["Task 1", "Task 2"],
-                        "resources": ["Resource 1"],
-                        "duration_hours": 2
-                    }}
-                ],
-                "assessment": "Short quiz or project"
-            }}
-        ]
-    }}
+    return _inflight.do(cache_key, _generate_learning_plan, cache_key, phase_name, skills)
 
-    Include exactly 4 weeks. Return ONLY JSON. No markdown. No explanations.'''
+
+def _generate_learning_plan(cache_key, phase_name, skills):
+    """Groq call behind generate_learning_plan (cache miss path)"""
+    skills_str = ', '.join(skills) if skills else 'core concepts'
+    
+    prompt = LEARNING_PLAN_PROMPT.format(phase_name=phase_name, skills=skills_str)
 
     try:
-        response = groq_client.chat.completions.create(
+        response = groq_completion(
             messages=[
-                {"role": "system", "content": "You are a JSON expert. Return ONLY valid JSON. No code blocks."},
+                {"role": "system", "content": JSON_SYSTEM_PROMPT},
                 {"role": "user", "content": prompt}
             ],
             model=GROQ_MODEL,
@@ -349,51 +865,12 @@ def generate_learning_plan(phase_name, skills):
             max_tokens=1500
         )
 
-        content = response.choices[0].message.content.strip()
-
-        # Remove code blocks
-        if content.startswith("```"):
-            lines = content.splitlines()
-            content = "\n".join(lines[1:-1] if lines[-1].strip().startswith("```") else lines[1:]).strip()
-
-        plan = json.loads(content)
-
-        # === VALIDATE & ENFORCE STRUCTURE ===
-        if "weekly_schedule" not in plan or not isinstance(plan["weekly_schedule"], list):
-            raise ValueError("Missing weekly_schedule")
-
-        weeks = plan["weekly_schedule"][:4]
-        if len(weeks) == 0:
-            raise ValueError("No weeks generated")
-
-        # Ensure each week has required keys
-        for i, week in enumerate(weeks):
-            week.setdefault("week", i + 1)
-            week.setdefault("learning_objectives", [f"Learn core concepts of week {i+1}"])
-            week.setdefault("assessment", "Complete daily tasks")
-
-            # Fix daily_tasks
-            daily = week.get("daily_tasks", [])
-            if not isinstance(daily, list) or len(daily) == 0:
-                daily = [{
-                    "day": 1,
-                    "tasks": [f"Study {phase_name} fundamentals"],
-                    "resources": ["Online tutorial"],
-                    "duration_hours": 2
-                }]
-            week["daily_tasks"] = daily[:5]  # Limit to 5 days
-
-        # Pad to 4 weeks if needed
-        while len(weeks) < 4:
-            last = weeks[-1]
-            weeks.append({
-                "week": len(weeks) + 1,
-                "learning_objectives": last["learning_objectives"],
-                "daily_tasks": last["daily_tasks"],
-                "assessment": last["assessment"]
-            })
+        # Remove code blocks if present
+        content = _strip_code_fence(response.choices[0].message.content)
 
-        return {"weekly_schedule": weeks}
+        plan = _normalize_learning_plan(_json_loads(content), phase_name)
+        _llm_cache_set(cache_key, plan)
+        return plan
 
     except Exception as e:
         print(f"[Groq] Learning plan failed: {e}")
@@ -411,7 +888,185 @@ def generate_learning_plan(phase_name, skills):
             ],
             "assessment": "Complete setup and notes"
         }
-        return {"weekly_schedule": [fallback_week] * 4}
+        return {"weekly_schedule": [{**deepcopy(fallback_week), "week": n} for n in range(1, 5)]}
+
+
+def generate_learning_plans_batch(phases):
+    """
+    Generate learning plans for several roadmap phases with a single Groq call.
+
+    Args:
+        phases (list): Dicts with 'name' and 'skills' for each phase
+
+    Returns:
+        list: One learning plan per phase, in the same order
+    """
+    if not phases:
+        return []
+    if not GROQ_API_KEY:
+        return [generate_learning_plan(p.get("name", ""), p.get("skills", [])) for p in phases]
+
+    plans = [None] * len(phases)
+    cache_keys = []
+    pending = []
+    for i, phase in enumerate(phases):
+        key = _llm_cache_key(
+            "learning_plan",
+            phase_name=str(phase.get("name", "")).strip().lower(),
+            skills=sorted(str(s).strip().lower() for s in phase.get("skills") or []),
+        )
+        cache_keys.append(key)
+        plans[i] = _llm_cache_get(key)
+        if plans[i] is None:
+            pending.append(i)
+
+    if not pending:
+        return plans
+
+    sections = "\n".join(
+        f'=== PHASE [{n}] name="{phases[i].get("name", "")}" '
+        f'skills="{", ".join(map(str, phases[i].get("skills") or [])) or "core concepts"}" ==='
+        for n, i in enumerate(pending, start=1)
+    )
+
+    prompt = LEARNING_PLAN_BATCH_PROMPT.format(sections=sections)
+
+    batch = {}
+    try:
+        response = groq_completion(
+            messages=[
+                {"role": "system", "content": JSON_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            model=GROQ_MODEL,
+            temperature=0.1,
+            max_tokens=min(1500 * len(pending), 8000)
+        )
+
+        # Remove code blocks if present
+        content = _strip_code_fence(response.choices[0].message.content)
+
+        batch = _json_loads(content)
+        if not isinstance(batch, dict):
+            raise ValueError("Batch response is not an object")
+    except Exception as e:
+        print(f"[Groq] Batch learning plan failed: {e}")
+        batch = {}
+
+    retries = []
+    for n, i in enumerate(pending, start=1):
+        phase_name = phases[i].get("name", "")
+        try:
+            plans[i] = _normalize_learning_plan(batch.get(str(n)), phase_name)
+            _llm_cache_set(cache_keys[i], plans[i])
+        except Exception as e:
+            # Missing or malformed entry: retry this phase on its own
+            print(f"[Groq] Batch entry {n} unusable ({e}), generating individually")
+            retries.append(i)
+
+    for i, plan in zip(retries, generate_learning_plans_parallel([phases[i] for i in retries])):
+        plans[i] = plan
+
+    return plans
+
+
+def generate_learning_plans_parallel(phases):
+    """
+    Generate learning plans for several phases with one Groq call per phase,
+    run concurrently on the shared plan pool.
+
+    Args:
+        phases (list): Dicts with 'name' and 'skills' for each phase
+
+    Returns:
+        list: One learning plan per phase, in the same order
+    """
+    return list(_plan_pool.map(
+        lambda phase: generate_learning_plan(phase.get("name", ""), phase.get("skills", [])),
+        phases
+    ))
+
+
+@lru_cache(maxsize=256)
+def _render_tutor_system_prompt(topic, objectives, skills, resources):
+    """Render the tutor system prompt from hashable (tuple) module details"""
+    resources_str = "\n".join(f"{k}: {', '.join(v)}" for k, v in resources)
+    return TUTOR_SYSTEM_PROMPT + TUTOR_MODULE_CONTEXT.format(
+        topic=topic,
+        objectives=', '.join(objectives),
+        skills=', '.join(skills),
+        resources=resources_str,
+    )
+
+
+def _tutor_system_prompt(topic, objectives, skills, resources):
+    """
+    System prompt for a tutor turn: shared instructions first, then the module
+    details. Every turn in a module renders the same prompt, so it's memoized.
+    """
+    args = (
+        str(topic),
+        tuple(objectives),
+        tuple(skills),
+        tuple((k, tuple(v)) for k, v in resources.items()),
+    )
+    try:
+        return _render_tutor_system_prompt(*args)
+    except TypeError:
+        # Unhashable entries (e.g. nested dicts) can't be memoized; render directly
+        return _render_tutor_system_prompt.__wrapped__(*args)
+
+
+# Rough prompt budget for tutor history; ~4 characters per token is close
+# enough for English text and needs no tokenizer
+TUTOR_CONTEXT_TOKEN_BUDGET = 6000
+CHARS_PER_TOKEN = 4
+
+def _estimate_tokens(text):
+    """Cheap token estimate for budgeting (no tokenizer round-trip)"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _tutor_messages(message, topic, objectives, skills, resources, conversation_context):
+    """
+    System prompt, as much recent history as fits TUTOR_CONTEXT_TOKEN_BUDGET,
+    then the user's message. Oldest turns are dropped first.
+    """
+    user_message = {"role": "user", "content": message}
+    budget = TUTOR_CONTEXT_TOKEN_BUDGET - _estimate_tokens(message)
+
+    history = []
+    for m in reversed(conversation_context):
+        budget -= _estimate_tokens(str(m.get("content", "")))
+        if budget < 0:
+            break
+        history.append(m)
+    history.reverse()
+
+    return [
+        {"role": "system", "content": _tutor_system_prompt(topic, objectives, skills, resources)},
+        *history,
+        user_message,
+    ]
+
+
+def _tutor_cache_key(message, topic, objectives, skills, resources, conversation_context):
+    """
+    Exact-match key for a tutor turn. Same module, same (normalized) question
+    and same prior conversation, so first questions are shared across users.
+    """
+    return _llm_cache_key(
+        "tutor",
+        topic=str(topic),
+        objectives=[str(o) for o in objectives],
+        skills=[str(s) for s in skills],
+        resources=_json_dumps_sorted(resources),
+        message=str(message).strip().lower(),
+        context=[
+            [m.get("role"), str(m.get("content", "")).strip().lower()]
+            for m in conversation_context
+        ],
+    )
 
 
 def get_groq_response(message, topic, objectives, skills, resources, conversation_context=[]):
@@ -421,27 +1076,23 @@ def get_groq_response(message, topic, objectives, skills, resources, conversatio
     if not GROQ_API_KEY:
         return "Tutor unavailable: GROQ_API_KEY missing"
 
-    resources_str = "\n".join([f"{k}: {', '.join(v)}" for k, v in resources.items()])
-
-    system_prompt = f"""You are an AI tutor for {topic}.
-Objectives: {', '.join(objectives)}
-Skills: {', '.join(skills)}
-Resources:
-{resources_str}
-Be concise, educational, and encouraging."""
+    cache_key = _tutor_cache_key(message, topic, objectives, skills, resources, conversation_context)
+    cached = _llm_cache_get(cache_key)
+    if cached is not None:
+        return cached
 
-    messages = [{"role": "system", "content": system_prompt}]
-    messages.extend(conversation_context)
-    messages.append({"role": "user", "content": message})
+    messages = _tutor_messages(message, topic, objectives, skills, resources, conversation_context)
 
     try:
-        response = groq_client.chat.completions.create(
+        response = groq_completion(
             messages=messages,
             model=GROQ_MODEL,
             temperature=0.5,
             max_tokens=1000
         )
-        return response.choices[0].message.content.strip()
+        reply = response.choices[0].message.content.strip()
+        _llm_cache_set(cache_key, reply)
+        return reply
     except Exception as e:
         print(f"[Groq] Response error: {e}")
         return "Sorry, I couldn't respond. Try again!"
@@ -455,30 +1106,36 @@ def get_groq_response_stream(message, topic, objectives, skills, resources, conv
         yield "Tutor unavailable"
         return
 
-    resources_str = "\n".join([f"{k}: {', '.join(v)}" for k, v in resources.items()])
-
-    system_prompt = f"""You are an AI tutor for {topic}.
-Objectives: {', '.join(objectives)}
-Skills: {', '.join(skills)}
-Resources:
-{resources_str}
-Be concise and educational."""
+    cache_key = _tutor_cache_key(message, topic, objectives, skills, resources, conversation_context)
+    cached = _llm_cache_get(cache_key)
+    if cached is not None:
+        yield cached
+        return
 
-    messages = [{"role": "system", "content": system_prompt}]
-    messages.extend(conversation_context)
-    messages.append({"role": "user", "content": message})
+    messages = _tutor_messages(message, topic, objectives, skills, resources, conversation_context)
 
     try:
-        stream = groq_client.chat.completions.create(
-            messages=messages,
-            model=GROQ_MODEL,
-            temperature=0.5,
-            max_tokens=1000,
-            stream=True
-        )
-        for chunk in stream:
-            if chunk.choices[0].delta.content:
-                yield chunk.choices[0].delta.content
+        # Hold the slot until the stream is fully consumed
+        _acquire_groq_slot()
+        try:
+            stream = _groq_create(
+                messages=messages,
+                model=GROQ_MODEL,
+                temperature=0.5,
+                max_tokens=1000,
+                stream=True
+            )
+            chunks = []
+            for chunk in stream:
+                if chunk.choices[0].delta.content:
+                    chunks.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+        finally:
+            _groq_slots.release()
+        # Only complete replies are cached
+        reply = "".join(chunks).strip()
+        if reply:
+            _llm_cache_set(cache_key, reply)
     except Exception as e:
         print(f"[Groq] Stream error: {e}")
         yield "Error in stream"
\ No newline at end of file
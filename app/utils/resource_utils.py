@@ -1,8 +1,57 @@
 import os
-import requests
+import hashlib
+import threading
+from datetime import datetime, timedelta
 from urllib.parse import quote
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+from cachetools import LRUCache
+from app.utils.db_utils import get_db
+from app.utils.http_utils import SESSION, DEFAULT_TIMEOUT
+
+# Search results for a topic are stable for hours; cache them per source
+RESOURCE_CACHE_HOURS = 6
+
+def _resource_cache_key(source, topic):
+    """Cache key for one source's results on a (normalized) topic"""
+    return hashlib.sha256(f"{source}|{topic.strip().lower()}".encode("utf-8")).hexdigest()
+
+def get_cached_resources(topic, sources):
+    """
+    Look up unexpired cached results for several sources in one query
+
+    Returns:
+        dict: source -> results, for the sources that were cached
+    """
+    keys = {_resource_cache_key(source, topic): source for source in sources}
+    try:
+        docs = get_db().resource_cache.find(
+            {"_id": {"$in": list(keys)}, "expires_at": {"$gt": datetime.utcnow()}},
+            {"results": 1}
+        )
+        return {keys[doc["_id"]]: doc["results"] for doc in docs}
+    except Exception as e:
+        print(f"[Resources] Cache read failed: {e}")
+        return {}
+
+def cache_resources(topic, results):
+    """Store each source's results; empty results (often API errors) aren't cached"""
+    expires_at = datetime.utcnow() + timedelta(hours=RESOURCE_CACHE_HOURS)
+    for source, items in results.items():
+        if not items:
+            continue
+        try:
+            get_db().resource_cache.update_one(
+                {"_id": _resource_cache_key(source, topic)},
+                {"$set": {"results": items, "expires_at": expires_at}},
+                upsert=True
+            )
+        except Exception as e:
+            print(f"[Resources] Cache write failed: {e}")
+
+YOUTUBE_SEARCH_URL = "https://www.googleapis.com/youtube/v3/search"
+
+# Partial responses: ask Google APIs for only the fields we map, not the full resources
+YOUTUBE_SEARCH_FIELDS = "items(id/videoId,snippet(title,description,thumbnails/medium/url,publishedAt,channelTitle))"
+GOOGLE_SEARCH_FIELDS = "items(title,link,snippet,displayLink,formattedUrl)"
 
 def fetch_youtube_videos(query, max_results=5):
     """
@@ -16,22 +65,24 @@ def fetch_youtube_videos(query, max_results=5):
         list: List of video data
     """
     try:
-        # Initialize the YouTube API client
-        youtube = build(
-            'youtube', 
-            'v3', 
-            developerKey=os.getenv('YOUTUBE_API_KEY')
-        )
+        # Plain REST call on the shared session; no discovery document to load
+        params = {
+            'key': os.getenv('YOUTUBE_API_KEY'),
+            'q': query,
+            'part': 'snippet',
+            'maxResults': max_results,
+            'type': 'video',
+            'relevanceLanguage': 'en',
+            'safeSearch': 'moderate',
+            'fields': YOUTUBE_SEARCH_FIELDS
+        }
+        response = SESSION.get(YOUTUBE_SEARCH_URL, params=params, timeout=DEFAULT_TIMEOUT)
         
-        # Execute the search
-        search_response = youtube.search().list(
-            q=query,
-            part='snippet',
-            maxResults=max_results,
-            type='video',
-            relevanceLanguage='en',
-            safeSearch='moderate'
-        ).execute()
+        if response.status_code != 200:
+            print(f"YouTube API error: {response.status_code} - {response.text}")
+            return []
+        
+        search_response = response.json()
         
         # Process the results
         videos = []
@@ -49,9 +100,6 @@ def fetch_youtube_videos(query, max_results=5):
         
         return videos
     
-    except HttpError as e:
-        print(f"YouTube API error: {e}")
-        return []
     except Exception as e:
         print(f"Error fetching YouTube videos: {e}")
         return []
@@ -67,11 +115,6 @@ def fetch_google_scholar_papers(query, max_results=5):
     Returns:
         list: List of paper data
     """
-    import os
-    import requests
-    
-    print("Query- ", query)
-    
     try:
         # RapidAPI endpoint for Google Scholar
         url = "https://google-scholar1.p.rapidapi.com/search_pubs"
@@ -93,7 +136,7 @@ def fetch_google_scholar_papers(query, max_results=5):
         }
         
         # Make the API request
-        response = requests.get(url, headers=headers, params=querystring)
+        response = SESSION.get(url, headers=headers, params=querystring, timeout=DEFAULT_TIMEOUT)
         
         if response.status_code != 200:
             print(f"Google Scholar API error: {response.status_code} - {response.text}")
@@ -121,15 +164,11 @@ def fetch_google_scholar_papers(query, max_results=5):
                     'url': item.get('pub_url', '')
                 }
                 papers.append(paper)
-                print(f"Added paper: {paper['title']}")
         
-        print(f"Found {len(papers)} papers")
         return papers
     
     except Exception as e:
-        import traceback
         print(f"Error fetching Google Scholar papers: {e}")
-        print(traceback.format_exc())
         return []
     
 def fetch_google_search_results(query, max_results=5):
@@ -152,11 +191,12 @@ def fetch_google_search_results(query, max_results=5):
             'key': os.getenv('GOOGLE_CUSTOM_SEARCH_API_KEY'),
             'cx': '017576662512468239146:omuauf_lfve',  # This is a placeholder, you need to create a CSE and get your own cx value
             'q': query,
-            'num': max_results
+            'num': max_results,
+            'fields': GOOGLE_SEARCH_FIELDS
         }
         
         # Make the API request
-        response = requests.get(url, params=params)
+        response = SESSION.get(url, params=params, timeout=DEFAULT_TIMEOUT)
         
         if response.status_code != 200:
             print(f"Google Search API error: {response.status_code} - {response.text}")
@@ -181,6 +221,11 @@ def fetch_google_search_results(query, max_results=5):
         print(f"Error fetching Google search results: {e}")
         return []
 
+# url -> (ETag, repos) so repeat searches can be revalidated with If-None-Match;
+# GitHub's 304 has no body and doesn't count against the rate limit
+_github_etags = LRUCache(maxsize=512)
+_github_etags_lock = threading.Lock()
+
 def fetch_github_repositories(query, max_results=5):
     """
     Fetch relevant GitHub repositories
@@ -196,8 +241,15 @@ def fetch_github_repositories(query, max_results=5):
         # GitHub Search API endpoint
         url = f"https://api.github.com/search/repositories?q={quote(query)}&sort=stars&order=desc&per_page={max_results}"
         
-        # Make the API request
-        response = requests.get(url)
+        with _github_etags_lock:
+            etag, cached = _github_etags.get(url, (None, None))
+        
+        # Make the API request (conditional when we have a previous answer)
+        headers = {"If-None-Match": etag} if etag else None
+        response = SESSION.get(url, headers=headers, timeout=DEFAULT_TIMEOUT)
+        
+        if response.status_code == 304 and cached is not None:
+            return cached
         
         if response.status_code != 200:
             print(f"GitHub API error: {response.status_code} - {response.text}")
@@ -219,6 +271,10 @@ def fetch_github_repositories(query, max_results=5):
                 'updated_at': item.get('updated_at')
             })
         
+        if response.headers.get("ETag"):
+            with _github_etags_lock:
+                _github_etags[url] = (response.headers["ETag"], repos)
+        
         return repos
     
     except Exception as e: